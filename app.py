@@ -1,13 +1,26 @@
 import os
-from flask import Flask, render_template, request, jsonify, redirect, url_for, abort
+import json
+import threading
+import time
+from flask import Flask, render_template, request, jsonify, redirect, url_for, abort, Response, g, has_app_context
+import click
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.sql import func
+from sqlalchemy import select, update, exists, insert, delete, case, inspect as ispeziona
+from sqlalchemy.schema import CreateTable, CreateIndex
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from dotenv import load_dotenv
 from datetime import timedelta
+from db_pool import opzioni_engine, metriche_pool
+
+try:
+    import brotli # Opzionale: se installato abilita la compressione 'br'
+except ImportError:
+    brotli = None
 
 # --- 1. CONFIGURAZIONE INIZIALE ---
 
@@ -20,14 +33,117 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Pool di connessioni (dimensione, pre-ping, riciclo sotto il wait_timeout di MySQL)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opzioni_engine('primary')
+
+# Replica in sola lettura (opzionale): se non configurata tutto va sul primary
+if os.environ.get('DATABASE_REPLICA_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': {'url': os.environ.get('DATABASE_REPLICA_URL'), **opzioni_engine('replica')}
+    }
+
 # === AGGIUNGI QUESTA RIGA ===
 # Imposta la scadenza automatica della sessione (es. 8 ore)
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=8)
 
+# Indice di disponibilità per la ricerca delle fasce libere (intervalli da 15 minuti su 7 giorni)
+app.config['DISPONIBILITA_BUCKET_MINUTI'] = int(os.environ.get('DISPONIBILITA_BUCKET_MINUTI', 15))
+app.config['DISPONIBILITA_ORIZZONTE_GIORNI'] = int(os.environ.get('DISPONIBILITA_ORIZZONTE_GIORNI', 7))
+app.config['DISPONIBILITA_REFRESH_SECONDI'] = int(os.environ.get('DISPONIBILITA_REFRESH_SECONDI', 300))
+
+# Hash delle password: metodo werkzeug (vuoto = default), thread dedicati e coda massima
+app.config['PASSWORD_HASH_METODO'] = os.environ.get('PASSWORD_HASH_METODO') or None
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_CODA'] = int(os.environ.get('PASSWORD_HASH_MAX_CODA', 32))
+
+# Tentativi di login consentiti al minuto (e come raffica) per IP e per email
+app.config['LOGIN_TENTATIVI_IP_MINUTO'] = int(os.environ.get('LOGIN_TENTATIVI_IP_MINUTO', 20))
+app.config['LOGIN_TENTATIVI_EMAIL_MINUTO'] = int(os.environ.get('LOGIN_TENTATIVI_EMAIL_MINUTO', 5))
+
+# Scadenza automatica delle prenotazioni: righe per batch, batch per esecuzione,
+# intervallo del worker in background (0 = disattivato, usare 'flask scadi-prenotazioni' da cron)
+app.config['SCADENZE_BATCH'] = int(os.environ.get('SCADENZE_BATCH', 500))
+app.config['SCADENZE_MAX_BATCH'] = int(os.environ.get('SCADENZE_MAX_BATCH', 20))
+app.config['SCADENZE_INTERVALLO_SECONDI'] = int(os.environ.get('SCADENZE_INTERVALLO_SECONDI', 0))
+
+# Snapshot Parquet (vedi snapshot.py): se impostato le statistiche leggono da lì e non dal DB
+app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR') or None
+
+# Previsione della domanda (PREDIZIONE): giorni di storico, giorni previsti,
+# lato della cella della griglia in gradi (~500 m), numero di celle salvate
+app.config['PREVISIONE_GIORNI_STORICO'] = int(os.environ.get('PREVISIONE_GIORNI_STORICO', 56))
+app.config['PREVISIONE_GIORNI'] = int(os.environ.get('PREVISIONE_GIORNI', 7))
+app.config['PREVISIONE_PASSO_GRADI'] = float(os.environ.get('PREVISIONE_PASSO_GRADI', 0.005))
+app.config['PREVISIONE_TOP'] = int(os.environ.get('PREVISIONE_TOP', 100))
+
+# Ingest della telemetria delle colonnine: token delle colonnine (vuoto = ingest disattivato),
+# sessioni per scrittura, intervallo massimo tra due scritture, sessioni in attesa prima di rifiutare
+app.config['INGEST_TOKEN'] = os.environ.get('INGEST_TOKEN') or None
+app.config['INGEST_MAX_SESSIONI'] = int(os.environ.get('INGEST_MAX_SESSIONI', 5000))
+app.config['INGEST_INTERVALLO_SECONDI'] = float(os.environ.get('INGEST_INTERVALLO_SECONDI', 1.0))
+app.config['INGEST_MAX_IN_ATTESA'] = int(os.environ.get('INGEST_MAX_IN_ATTESA', 100000))
+# Limiti per singola richiesta di ingest: eventi e byte del body decompresso
+app.config['INGEST_MAX_RIGHE'] = int(os.environ.get('INGEST_MAX_RIGHE', 10000))
+app.config['INGEST_MAX_BYTE'] = int(os.environ.get('INGEST_MAX_BYTE', 8 * 1024 * 1024))
+
+# Dimensione massima di qualsiasi body in arrivo (oltre: 413), compresso o no
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 8 * 1024 * 1024))
+
+# Cache e compressione delle risposte JSON delle API (mappa e admin)
+app.config['API_CACHE_TTL_SECONDI'] = float(os.environ.get('API_CACHE_TTL_SECONDI', 10))
+app.config['COMPRESSIONE_SOGLIA_BYTE'] = int(os.environ.get('COMPRESSIONE_SOGLIA_BYTE', 1024))
+
+class RoutingSession(Session):
+    """
+    Sessione che manda le letture alla replica quando la rotta è marcata @sola_lettura.
+    Le scritture (flush) vanno sempre sul primary.
+    """
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if has_app_context() and g.get('usa_replica') and not self._flushing:
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause, **kwargs)
+
 # Inizializza estensioni
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 CORS(app) # Permette al frontend JS di chiamare il backend
 
+# Predizione in-process (opzionale): stesso endpoint del prediction_server,
+# servito da questo processo sotto /predizione/predict senza un server separato
+if os.environ.get('PREDIZIONE_IN_PROCESSO') == '1':
+    from inference import Predictor, create_predict_blueprint
+    predictor = Predictor(os.environ.get('MODEL_FILENAME', 'model.pkl'))
+    predictor.warm_up_in_background() # Non rallenta l'avvio: pronto quando /predizione/ready risponde 200
+    app.register_blueprint(create_predict_blueprint(predictor), url_prefix='/predizione')
+
+# Hash delle password in un pool limitato e limitatori dei tentativi di login.
+# I moduli usati solo da alcune rotte (sicurezza_login, disponibilita, ingest_ricariche,
+# dialetto MySQL per l'upsert) si importano al primo uso: l'avvio del processo non li paga.
+_protezione_login = None
+_protezione_login_lock = threading.Lock()
+
+def protezione_login():
+    """Restituisce (backend_password, limitatore_ip, limitatore_email), creati alla prima chiamata."""
+    global _protezione_login
+    if _protezione_login is None:
+        with _protezione_login_lock:
+            if _protezione_login is None:
+                from sicurezza_login import BackendPassword, LimitatoreTokenBucket
+                _protezione_login = (
+                    BackendPassword(
+                        metodo=app.config['PASSWORD_HASH_METODO'],
+                        workers=app.config['PASSWORD_HASH_WORKERS'],
+                        max_coda=app.config['PASSWORD_HASH_MAX_CODA']
+                    ),
+                    LimitatoreTokenBucket(app.config['LOGIN_TENTATIVI_IP_MINUTO'], app.config['LOGIN_TENTATIVI_IP_MINUTO'] / 60.0),
+                    LimitatoreTokenBucket(app.config['LOGIN_TENTATIVI_EMAIL_MINUTO'], app.config['LOGIN_TENTATIVI_EMAIL_MINUTO'] / 60.0)
+                )
+    return _protezione_login
+
+def backend_password():
+    return protezione_login()[0]
+
 # Configurazione Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -50,12 +166,15 @@ class ACCOUNT(UserMixin, db.Model):
     def get_id(self):
         return (self.ID_Account)
 
-    # Metodi per la password
+    # Metodi per la password (calcolati nel pool del backend, vedi sicurezza_login.py)
     def set_password(self, password):
-        self.Password = generate_password_hash(password)
+        self.Password = backend_password().genera(password)
 
     def check_password(self, password):
-        return check_password_hash(self.Password, password)
+        return backend_password().verifica(self.Password, password)
+
+    def password_da_aggiornare(self):
+        return backend_password().da_aggiornare(self.Password)
 
 class UTENTE(db.Model):
     __tablename__ = 'utente'
@@ -114,6 +233,17 @@ class RICARICA(db.Model):
     ID_Utente = db.Column(db.Integer, db.ForeignKey('utente.ID_Utente'))
     ID_Colonnina = db.Column(db.Integer, db.ForeignKey('colonnina.ID_Colonnina'), nullable=False)
     Targa_Auto = db.Column(db.String(10), db.ForeignKey('auto.Targa'))
+    # "<id_colonnina>:<id_sessione>" per le ricariche arrivate dall'ingest (NULL per le altre)
+    Chiave_Idempotenza = db.Column(db.String(64))
+
+    # Unicità della chiave di idempotenza (upsert dell'ingest), con nome per "flask aggiorna-db"
+    # Sessioni aperte per colonnina (aggiornamento dello Stato dopo l'ingest)
+    # Conteggi per (colonnina, giorno) della previsione: l'indice copre tutta la query
+    __table_args__ = (
+        db.UniqueConstraint('Chiave_Idempotenza', name='uq_ricarica_chiave_idempotenza'),
+        db.Index('ix_ricarica_colonnina_fine', 'ID_Colonnina', 'Data_Ora_Fine'),
+        db.Index('ix_ricarica_inizio_colonnina', 'Data_Ora_Inizio', 'ID_Colonnina'),
+    )
 
 class PRENOTAZIONE(db.Model):
     __tablename__ = 'prenotazione'
@@ -125,6 +255,13 @@ class PRENOTAZIONE(db.Model):
     ID_Colonnina = db.Column(db.Integer, db.ForeignKey('colonnina.ID_Colonnina'), nullable=False)
     Targa_Auto = db.Column(db.String(10), db.ForeignKey('auto.Targa'), nullable=False)
 
+    # Ricerca delle sovrapposizioni per colonnina: range scan invece di full scan
+    # Ricerca delle prenotazioni attive scadute (worker delle scadenze)
+    __table_args__ = (
+        db.Index('ix_prenotazione_colonnina_intervallo', 'ID_Colonnina', 'Data_Ora_Inizio_Prenotazione', 'Data_Ora_Fine_Prenotazione'),
+        db.Index('ix_prenotazione_stato_fine', 'Stato', 'Data_Ora_Fine_Prenotazione'),
+    )
+
 class PREDIZIONE(db.Model):
     __tablename__ = 'predizione'
     ID_Predizione = db.Column(db.Integer, primary_key=True)
@@ -159,6 +296,93 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# --- 3.1 CACHE E COMPRESSIONE DELLE RISPOSTE JSON ---
+
+# Campi restituibili dalle API, selezionabili con il parametro ?fields=
+CAMPI_COLONNINA = ('id', 'indirizzo', 'lat', 'lng', 'potenza_kw', 'nil', 'stato')
+CAMPI_RICARICA = ('id', 'inizio', 'fine', 'kwh', 'utente', 'colonnina')
+
+# Per ogni (endpoint, campi) teniamo il corpo JSON già serializzato
+# e, accanto, le sue versioni compresse (gzip/br) calcolate alla prima richiesta
+_cache_api = {}
+_cache_api_lock = threading.Lock()
+
+def leggi_campi(ammessi):
+    """
+    Legge il parametro ?fields=id,lat,lng dalla query string.
+    Restituisce None (tutti i campi) oppure una tupla di campi validi, nell'ordine di 'ammessi'.
+    Solleva ValueError se viene richiesto un campo sconosciuto.
+    """
+    valore = request.args.get('fields')
+    if not valore:
+        return None
+    richiesti = {c.strip() for c in valore.split(',') if c.strip()}
+    sconosciuti = sorted(richiesti - set(ammessi))
+    if not richiesti or sconosciuti:
+        raise ValueError(f"Campi non validi: {', '.join(sconosciuti)}. Ammessi: {', '.join(ammessi)}")
+    # Ordine canonico: 'id,lat' e 'lat,id' usano la stessa voce della cache
+    # (al massimo 2^n combinazioni per endpoint, non n! permutazioni)
+    return tuple(c for c in ammessi if c in richiesti)
+
+def invalida_cache_api(*endpoint):
+    """Svuota la cache delle risposte (solo gli endpoint indicati, o tutta)."""
+    with _cache_api_lock:
+        if not endpoint:
+            _cache_api.clear()
+            return
+        for chiave in [k for k in _cache_api if k[0] in endpoint]:
+            del _cache_api[chiave]
+
+def _comprimi(body, codifica):
+    if codifica == 'br':
+        return brotli.compress(body, quality=5)
+    import gzip
+    return gzip.compress(body, compresslevel=6)
+
+def risposta_json_cache(endpoint, campi, genera_righe):
+    """
+    Restituisce una Response JSON per la lista prodotta da genera_righe(),
+    proiettata sui campi richiesti. Il corpo resta in cache per API_CACHE_TTL_SECONDI
+    e viene compresso (br o gzip, in base ad Accept-Encoding) solo sopra la soglia.
+    """
+    chiave = (endpoint, campi)
+    adesso = time.monotonic()
+    with _cache_api_lock:
+        voce = _cache_api.get(chiave)
+
+    if voce is None or voce['scadenza'] <= adesso:
+        righe = genera_righe()
+        if campi is not None:
+            righe = [{campo: r[campo] for campo in campi} for r in righe]
+        # Separatori compatti: niente spazi superflui nel payload
+        body = json.dumps(righe, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        voce = {'scadenza': adesso + app.config['API_CACHE_TTL_SECONDI'], 'body': body, 'compressi': {}}
+        with _cache_api_lock:
+            _cache_api[chiave] = voce
+
+    risposta = Response(voce['body'], mimetype='application/json')
+    risposta.vary.add('Accept-Encoding')
+    if len(voce['body']) < app.config['COMPRESSIONE_SOGLIA_BYTE']:
+        return risposta
+
+    codifica = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if codifica:
+        compresso = voce['compressi'].get(codifica)
+        if compresso is None:
+            compresso = _comprimi(voce['body'], codifica)
+            voce['compressi'][codifica] = compresso
+        risposta.set_data(compresso)
+        risposta.headers['Content-Encoding'] = codifica
+    return risposta
+
+# Decoratore per le rotte che leggono soltanto: le loro query vanno sulla replica
+def sola_lettura(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.usa_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Rotta per la pagina di login
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -169,10 +393,34 @@ def login():
         data = request.get_json()
         email = data.get('email')
         password = data.get('password')
+
+        # Limite ai tentativi, prima di qualsiasi query o calcolo di hash
+        from sicurezza_login import BackendSovraccarico
+        from concurrent.futures import TimeoutError as HashTimeoutError
+        _, limitatore_ip, limitatore_email = protezione_login()
+        for limitatore, chiave in ((limitatore_ip, request.remote_addr), (limitatore_email, (email or '').strip().lower())):
+            consentito, attesa = limitatore.consenti(chiave)
+            if not consentito:
+                risposta = jsonify({"status": "error", "message": "Troppi tentativi di login, riprova più tardi."})
+                risposta.headers['Retry-After'] = str(int(attesa) + 1)
+                return risposta, 429
         
         user = ACCOUNT.query.filter_by(Email=email).first()
+
+        try:
+            password_valida = bool(user and password and user.check_password(password))
+        except (BackendSovraccarico, HashTimeoutError):
+            return jsonify({"status": "error", "message": "Server occupato, riprova tra poco."}), 503
         
-        if user and user.check_password(password):
+        if password_valida:
+            # Rehash trasparente se l'hash salvato usa parametri non più attuali
+            if user.password_da_aggiornare():
+                try:
+                    user.set_password(password)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Aggiornamento hash password non riuscito per {user.Email}: {e}")
             login_user(user, remember=True)
             if user.Tipo_Account == 'admin':
                 return jsonify({"status": "success", "redirect": url_for('admin_dashboard')})
@@ -201,26 +449,180 @@ def mappa():
     return render_template('index.html', user_email=current_user.Email)
 
 # API per fornire i dati alla mappa
+# Con ?fields=id,lat,lng,stato si riceve solo quanto serve per disegnare i marker
 @app.route('/api/colonnine', methods=['GET'])
 @login_required
+@sola_lettura
 def get_colonnine():
-    colonnine_db = COLONNINA.query.all()
-    
+    try:
+        campi = leggi_campi(CAMPI_COLONNINA)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return risposta_json_cache('colonnine', campi, lambda: [serializza_colonnina(c) for c in COLONNINA.query.all()])
+
+# Dettaglio di una singola colonnina (usato dai popup della mappa)
+@app.route('/api/colonnine/<int:id>', methods=['GET'])
+@login_required
+@sola_lettura
+def get_colonnina(id):
+    colonnina = COLONNINA.query.get_or_404(id)
+    return jsonify(serializza_colonnina(colonnina))
+
+def serializza_colonnina(c):
     # Formattiamo i dati per la mappa (JSON)
-    colonnine_json = []
-    for c in colonnine_db:
-        colonnine_json.append({
-            "id": c.ID_Colonnina,
-            "indirizzo": c.Indirizzo,
-            "lat": float(c.Latitudine),
-            "lng": float(c.Longitudine),
-            "potenza_kw": float(c.Potenza_kW),
-            "nil": c.NIL,
-            "stato": c.Stato # Sarà 'disponibile' o 'occupata' ecc.
+    return {
+        "id": c.ID_Colonnina,
+        "indirizzo": c.Indirizzo,
+        "lat": float(c.Latitudine),
+        "lng": float(c.Longitudine),
+        "potenza_kw": float(c.Potenza_kW),
+        "nil": c.NIL,
+        "stato": c.Stato # Sarà 'disponibile' o 'occupata' ecc.
+    }
+
+# --- 4.1 DISPONIBILITÀ E FASCE LIBERE ---
+
+# L'indice vive in memoria ed è ricostruito dal DB ogni DISPONIBILITA_REFRESH_SECONDI;
+# le prenotazioni fatte da questo processo vengono aggiunte subito.
+# Il controllo definitivo sulle sovrapposizioni resta comunque sul DB (vedi prenota_colonnina).
+_indice_disponibilita = None
+_indice_disponibilita_lock = threading.Lock()
+
+def costruisci_indice_disponibilita():
+    from disponibilita import IndiceDisponibilita
+    indice = IndiceDisponibilita(
+        datetime.now(),
+        bucket_minuti=app.config['DISPONIBILITA_BUCKET_MINUTI'],
+        orizzonte_giorni=app.config['DISPONIBILITA_ORIZZONTE_GIORNI']
+    )
+    colonnine = db.session.query(
+        COLONNINA.ID_Colonnina, COLONNINA.Latitudine, COLONNINA.Longitudine, COLONNINA.NIL, COLONNINA.Stato
+    ).all()
+    for c in colonnine:
+        indice.aggiungi_colonnina(*c)
+
+    # Solo le prenotazioni attive che toccano l'orizzonte dell'indice
+    prenotazioni = db.session.query(
+        PRENOTAZIONE.ID_Colonnina, PRENOTAZIONE.Data_Ora_Inizio_Prenotazione, PRENOTAZIONE.Data_Ora_Fine_Prenotazione
+    ).filter(PRENOTAZIONE.Stato == 'attiva')\
+     .filter(PRENOTAZIONE.Data_Ora_Fine_Prenotazione > indice.origine)\
+     .filter(PRENOTAZIONE.Data_Ora_Inizio_Prenotazione < indice.fine_orizzonte)\
+     .all()
+    for p in prenotazioni:
+        indice.segna_prenotazione(*p)
+    return indice
+
+def indice_disponibilita():
+    """Restituisce l'indice, ricostruendolo se manca o è più vecchio del refresh configurato."""
+    global _indice_disponibilita
+    indice = _indice_disponibilita
+    scaduto = lambda i: i is None or (datetime.now() - i.creato).total_seconds() > app.config['DISPONIBILITA_REFRESH_SECONDI']
+    if scaduto(indice):
+        with _indice_disponibilita_lock:
+            indice = _indice_disponibilita
+            if scaduto(indice):
+                indice = costruisci_indice_disponibilita()
+                _indice_disponibilita = indice
+    return indice
+
+def invalida_indice_disponibilita():
+    # Chiamata quando cambiano le colonnine: la prossima ricerca ricostruisce l'indice
+    global _indice_disponibilita
+    _indice_disponibilita = None
+
+def inizio_imminente(adesso):
+    """
+    Le prenotazioni che iniziano entro un intervallo dell'indice contano già come in corso:
+    la colonnina passa a 'prenotata'. Stessa regola per prenota_colonnina, per il worker
+    delle scadenze e per l'aggiornamento dello Stato dopo l'ingest.
+    """
+    return adesso + timedelta(minutes=app.config['DISPONIBILITA_BUCKET_MINUTI'])
+
+def leggi_istante(valore, nome):
+    """Converte una data ISO 8601 della query string in datetime locale (naive, come nel DB)."""
+    if not valore:
+        raise ValueError(f"Devi specificare il parametro '{nome}' (formato ISO 8601)")
+    try:
+        istante = datetime.fromisoformat(valore)
+    except ValueError:
+        raise ValueError(f"Parametro '{nome}' non valido: usa il formato ISO 8601 (es. 2025-10-23T10:00)")
+    if istante.tzinfo is not None:
+        istante = istante.astimezone().replace(tzinfo=None)
+    return istante
+
+def leggi_intero(valore, nome, predefinito, minimo, massimo):
+    """Converte un intero della query string controllando che sia in [minimo, massimo]."""
+    if valore is None or valore == '':
+        return predefinito
+    try:
+        numero = int(valore)
+    except ValueError:
+        raise ValueError(f"Parametro '{nome}' non valido: deve essere un numero intero")
+    if not minimo <= numero <= massimo:
+        raise ValueError(f"Parametro '{nome}' non valido: deve essere tra {minimo} e {massimo}")
+    return numero
+
+# API di ricerca: colonnine con fasce libere in una finestra, vicino a un punto o in un NIL
+# Esempio: /api/disponibilita?inizio=2025-10-23T10:00&fine=2025-10-23T14:00&lat=45.46&lng=9.19&raggio_km=2
+@app.route('/api/disponibilita', methods=['GET'])
+@login_required
+@sola_lettura
+def cerca_disponibilita():
+    try:
+        inizio = leggi_istante(request.args.get('inizio'), 'inizio')
+        fine = leggi_istante(request.args.get('fine'), 'fine')
+        durata_minuti = leggi_intero(request.args.get('durata_minuti'), 'durata_minuti', 60, 1,
+                                     app.config['DISPONIBILITA_ORIZZONTE_GIORNI'] * 24 * 60)
+        durata = timedelta(minutes=durata_minuti)
+        limite = leggi_intero(request.args.get('limite'), 'limite', 50, 1, 500)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    if fine <= inizio:
+        return jsonify({"status": "error", "message": "'fine' deve essere successiva a 'inizio'"}), 400
+
+    indice = indice_disponibilita()
+    if not indice.copre(inizio, fine):
+        return jsonify({
+            "status": "error",
+            "message": f"Finestra fuori dall'orizzonte di ricerca ({indice.origine.isoformat()} - {indice.fine_orizzonte.isoformat()})"
+        }), 400
+
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    raggio_km = request.args.get('raggio_km', type=float)
+    nil = request.args.get('nil')
+
+    # Le colonnine occupate o prenotate adesso non si possono prenotare per una fascia
+    # immediata (vedi prenota_colonnina): le loro fasce partono dopo inizio_imminente,
+    # con un intervallo in più di margine per il tempo tra la ricerca e la prenotazione
+    prenotabile_da = inizio_imminente(inizio_imminente(datetime.now()))
+
+    risultati = []
+    for id_colonnina, distanza in indice.candidati(lat, lng, raggio_km, nil):
+        c_lat, c_lng, c_nil, stato = indice.colonnina(id_colonnina)
+        da = inizio if stato == 'disponibile' else max(inizio, prenotabile_da)
+        fasce = indice.fasce_libere(id_colonnina, da, fine, durata) if da < fine else []
+        if not fasce:
+            continue
+        risultati.append({
+            "id": id_colonnina,
+            "lat": c_lat,
+            "lng": c_lng,
+            "nil": c_nil,
+            "distanza_km": round(distanza, 3) if lat is not None and lng is not None else None,
+            "libera_intera_finestra": da == inizio and indice.libera(id_colonnina, inizio, fine),
+            "fasce_libere": [{"inizio": a.isoformat(), "fine": b.isoformat()} for a, b in fasce]
         })
-    return jsonify(colonnine_json)
+        if len(risultati) >= limite:
+            break
+
+    return jsonify({"status": "success", "inizio": inizio.isoformat(), "fine": fine.isoformat(), "colonnine": risultati})
 
 # API per prenotare una colonnina
+# Senza 'inizio'/'fine' prenota per 1 ora da adesso; con una fascia futura
+# verifica sul DB che non si sovrapponga ad altre prenotazioni attive
 @app.route('/api/prenota', methods=['POST'])
 @login_required
 def prenota_colonnina():
@@ -229,23 +631,45 @@ def prenota_colonnina():
         
     data = request.get_json()
     id_colonnina = data.get('id_colonnina')
+
+    try:
+        start_time = leggi_istante(data['inizio'], 'inizio') if data.get('inizio') else datetime.now()
+        end_time = leggi_istante(data['fine'], 'fine') if data.get('fine') else start_time + timedelta(hours=1)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if end_time <= start_time:
+        return jsonify({"status": "error", "message": "'fine' deve essere successiva a 'inizio'"}), 400
     
     # Semplificazione: troviamo la prima auto dell'utente
     auto_utente = AUTO.query.filter_by(ID_Utente=current_user.ID_Account).first()
     if not auto_utente:
         return jsonify({"status": "error", "message": "Nessuna auto registrata per questo utente"}), 400
 
-    colonnina = COLONNINA.query.get(id_colonnina)
+    # SELECT ... FOR UPDATE sulla colonnina: due prenotazioni concorrenti sulla stessa
+    # colonnina vengono serializzate, così il controllo delle sovrapposizioni qui sotto
+    # e l'INSERT avvengono senza che un'altra richiesta si inserisca in mezzo
+    colonnina = COLONNINA.query.with_for_update().get(id_colonnina)
     
     if not colonnina:
+        db.session.rollback()
         return jsonify({"status": "error", "message": "Colonnina non trovata"}), 404
-        
-    if colonnina.Stato != 'disponibile':
+
+    # Una prenotazione che parte adesso (o entro inizio_imminente) richiede la colonnina libera in questo momento
+    immediata = start_time <= inizio_imminente(datetime.now())
+    if colonnina.Stato == 'manutenzione' or (immediata and colonnina.Stato != 'disponibile'):
+        db.session.rollback()
         return jsonify({"status": "error", "message": "Colonnina non disponibile"}), 400
-        
-    # Logica di prenotazione (semplificata: prenotiamo per 1 ora da adesso)
-    start_time = datetime.now()
-    end_time = start_time + datetime.timedelta(hours=1)
+
+    # Sovrapposizioni con altre prenotazioni attive (usa ix_prenotazione_colonnina_intervallo)
+    sovrapposta = db.session.query(PRENOTAZIONE.ID_Prenotazione)\
+        .filter(PRENOTAZIONE.ID_Colonnina == colonnina.ID_Colonnina)\
+        .filter(PRENOTAZIONE.Stato == 'attiva')\
+        .filter(PRENOTAZIONE.Data_Ora_Inizio_Prenotazione < end_time)\
+        .filter(PRENOTAZIONE.Data_Ora_Fine_Prenotazione > start_time)\
+        .first()
+    if sovrapposta:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": "Fascia oraria già prenotata"}), 400
     
     try:
         # Creiamo la prenotazione
@@ -254,15 +678,20 @@ def prenota_colonnina():
             Data_Ora_Fine_Prenotazione=end_time,
             Stato='attiva',
             ID_Utente=current_user.ID_Account,
-            ID_Colonnina=id_colonnina,
+            ID_Colonnina=colonnina.ID_Colonnina,
             Targa_Auto=auto_utente.Targa
         )
         
-        # Aggiorniamo lo stato della colonnina
-        colonnina.Stato = 'prenotata'
+        # Aggiorniamo lo stato della colonnina (solo se la prenotazione parte adesso);
+        # per quelle future lo fa il worker delle scadenze quando arriva l'inizio
+        if immediata:
+            colonnina.Stato = 'prenotata'
         
         db.session.add(nuova_prenotazione)
         db.session.commit()
+        invalida_cache_api('colonnine')
+        if _indice_disponibilita is not None:
+            _indice_disponibilita.segna_prenotazione(colonnina.ID_Colonnina, start_time, end_time)
         
         return jsonify({"status": "success", "message": f"Colonnina {id_colonnina} prenotata!"})
         
@@ -295,6 +724,8 @@ def crea_colonnina():
         )
         db.session.add(nuova_colonnina)
         db.session.commit()
+        invalida_cache_api('colonnine')
+        invalida_indice_disponibilita()
         return jsonify({"status": "success", "message": "Colonnina creata"}), 201
     except Exception as e:
         db.session.rollback()
@@ -312,11 +743,15 @@ def gestisci_colonnina(id):
         colonnina.NIL = data.get('nil', colonnina.NIL)
         colonnina.Stato = data.get('stato', colonnina.Stato)
         db.session.commit()
+        invalida_cache_api('colonnine')
+        invalida_indice_disponibilita()
         return jsonify({"status": "success", "message": "Colonnina aggiornata"})
 
     elif request.method == 'DELETE':
         db.session.delete(colonnina)
         db.session.commit()
+        invalida_cache_api('colonnine')
+        invalida_indice_disponibilita()
         return jsonify({"status": "success", "message": "Colonnina eliminata"})
 
 # REQ 4: CRUD Utenti (Semplificato: Creazione e Lista)
@@ -363,7 +798,16 @@ def gestisci_utenti():
 # REQ 5: Elenco ricariche totali
 @app.route('/api/admin/ricariche', methods=['GET'])
 @admin_required
+@sola_lettura
 def get_ricariche():
+    try:
+        campi = leggi_campi(CAMPI_RICARICA)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return risposta_json_cache('ricariche', campi, elenco_ricariche)
+
+def elenco_ricariche():
     # Join tra Ricarica, Utente e Colonnina per avere dati leggibili
     ricariche_db = db.session.query(
         RICARICA.ID_Ricarica,
@@ -378,7 +822,7 @@ def get_ricariche():
      .order_by(RICARICA.Data_Ora_Inizio.desc())\
      .all()
      
-    ricariche_json = [{
+    return [{
         "id": r[0],
         "inizio": r[1].isoformat(),
         "fine": r[2].isoformat() if r[2] else None,
@@ -386,20 +830,32 @@ def get_ricariche():
         "utente": f"{r[4]} {r[5]}",
         "colonnina": r[6]
     } for r in ricariche_db]
-    
-    return jsonify(ricariche_json)
+
+# Metriche del pool di connessioni (attesa al checkout e stato attuale)
+@app.route('/api/admin/metriche/pool', methods=['GET'])
+@admin_required
+def get_metriche_pool():
+    stato = {nome or 'primary': engine.pool.status() for nome, engine in db.engines.items()}
+    return jsonify({"status": "success", "attese": metriche_pool(), "pool": stato})
 
 # ... (tutto il codice precedente fino a @admin_required) ...
 
 # REQ 6: Statistiche ricariche per quartiere (NIL)
 @app.route('/api/admin/statistiche/ricariche_giorno', methods=['GET'])
 @admin_required
+@sola_lettura
 def get_statistiche_nil():
     quartiere_nil = request.args.get('nil')
     if not quartiere_nil:
         return jsonify({"status": "error", "message": "Devi specificare un parametro 'nil' (quartiere)"}), 400
 
     try:
+        # Con gli snapshot configurati il DB operativo non viene interrogato
+        if app.config['SNAPSHOT_DIR']:
+            from snapshot import ricariche_per_giorno
+            labels, data = ricariche_per_giorno(app.config['SNAPSHOT_DIR'], quartiere_nil)
+            return jsonify({"status": "success", "nil": quartiere_nil, "labels": labels, "data": data})
+
         # Eseguiamo una query complessa:
         # 1. Filtra le colonnine per NIL
         # 2. Si unisce alle ricariche
@@ -423,6 +879,177 @@ def get_statistiche_nil():
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# --- 5.1 PREVISIONE SPAZIALE DELLA DOMANDA (PREDIZIONE) ---
+# Le ricariche recenti vengono lette a blocchi (dagli snapshot se configurati,
+# altrimenti dal DB con cursore lato server) e contate su una griglia per NIL
+# con NumPy (vedi previsione_domanda.py). Le celle con più domanda prevista
+# vengono salvate in PREDIZIONE con un solo INSERT multiplo.
+
+RIGHE_PER_BLOCCO_PREVISIONE = 200000
+
+def _query_conteggi_previsione(inizio, fine):
+    # DATE() esiste in MySQL, SQLite e PostgreSQL: il giorno dall'inizio si calcola poi con NumPy
+    giorno = func.date(RICARICA.Data_Ora_Inizio, type_=db.Date)
+    return (
+        select(RICARICA.ID_Colonnina, giorno, func.count())
+        .where(RICARICA.Data_Ora_Inizio >= inizio, RICARICA.Data_Ora_Inizio < fine)
+        .group_by(RICARICA.ID_Colonnina, giorno)
+    )
+
+def _blocchi_ricariche(inizio, fine):
+    """
+    Genera terne di array NumPy (ID_Colonnina, giorno dall'inizio, numero di ricariche)
+    per le ricariche in [inizio, fine). Il numero è None quando ogni riga è una ricarica.
+    """
+    import numpy as np
+
+    if app.config['SNAPSHOT_DIR']:
+        from snapshot import blocchi_ricariche
+        origine = np.datetime64(inizio, 'us')
+        for blocco in blocchi_ricariche(app.config['SNAPSHOT_DIR'], inizio, fine, ['ID_Colonnina', 'Data_Ora_Inizio'],
+                                        RIGHE_PER_BLOCCO_PREVISIONE):
+            id_colonnine = blocco.column('ID_Colonnina').to_numpy(zero_copy_only=False)
+            istanti = blocco.column('Data_Ora_Inizio').to_numpy(zero_copy_only=False).astype('datetime64[us]')
+            yield id_colonnine, (istanti - origine) // np.timedelta64(1, 'D'), None
+        return
+
+    # Dal DB non arrivano le ricariche ma i conteggi per (colonnina, giorno), calcolati
+    # con ix_ricarica_inizio_colonnina (indice coprente): al massimo colonnine x giorni righe,
+    # invece di decine di milioni convertite una per una da PyMySQL.
+    origine = np.datetime64(inizio.date(), 'D')
+    engine = db.engines.get('replica') or db.engine
+    with engine.connect() as connessione:
+        risultato = connessione.execution_options(stream_results=True, yield_per=RIGHE_PER_BLOCCO_PREVISIONE)\
+            .execute(_query_conteggi_previsione(inizio, fine))
+        for righe in risultato.partitions():
+            id_colonnine, giorni, conteggi = zip(*righe)
+            yield (np.array(id_colonnine, dtype=np.int64),
+                   (np.array(giorni, dtype='datetime64[D]') - origine).astype(np.int64),
+                   np.array(conteggi, dtype=np.int64))
+
+def genera_predizioni(id_amministratore=None, giorni_storico=None, giorni_previsione=None, passo_gradi=None, top=None):
+    """Calcola e salva le predizioni del prossimo periodo. Restituisce (periodo, numero di righe salvate)."""
+    from previsione_domanda import GrigliaDomanda, prevedi, migliori_celle
+
+    giorni_storico = giorni_storico or app.config['PREVISIONE_GIORNI_STORICO']
+    giorni_previsione = giorni_previsione or app.config['PREVISIONE_GIORNI']
+    passo_gradi = passo_gradi or app.config['PREVISIONE_PASSO_GRADI']
+    top = top or app.config['PREVISIONE_TOP']
+
+    # Storico: gli ultimi giorni interi, fino a oggi escluso
+    fine = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    inizio = fine - timedelta(days=giorni_storico)
+
+    colonnine = db.session.query(COLONNINA.ID_Colonnina, COLONNINA.Latitudine, COLONNINA.Longitudine, COLONNINA.NIL).all()
+    if not colonnine:
+        return None, 0
+    griglia = GrigliaDomanda(
+        [c[0] for c in colonnine], [float(c[1]) for c in colonnine], [float(c[2]) for c in colonnine],
+        [c[3] for c in colonnine], passo_gradi, giorni_storico
+    )
+    for id_colonnine, giorni, conteggi in _blocchi_ricariche(inizio, fine):
+        griglia.aggiungi(id_colonnine, giorni, conteggi)
+
+    celle = migliori_celle(griglia, prevedi(griglia.matrice, giorni_previsione), top)
+    periodo = f"{fine.date().isoformat()}/{(fine + timedelta(days=giorni_previsione - 1)).date().isoformat()}"
+
+    # Rigenerare lo stesso periodo sostituisce le predizioni precedenti
+    db.session.execute(delete(PREDIZIONE).where(PREDIZIONE.Periodo_Riferimento == periodo))
+    if celle:
+        # Inserite in ordine di domanda decrescente: l'ordine degli ID è la classifica
+        db.session.execute(insert(PREDIZIONE), [{
+            "Periodo_Riferimento": periodo,
+            "Latitudine_Prevista": round(c['lat'], 6),
+            "Longitudine_Prevista": round(c['lng'], 6),
+            "NIL_Riferimento": c['nil'],
+            "Domanda_Prevista": f"{c['domanda']:.2f}",
+            "ID_Amministratore": id_amministratore
+        } for c in celle])
+    db.session.commit()
+    return periodo, len(celle)
+
+# Parametri opzionali del body: (tipo, minimo escluso, massimo incluso)
+PARAMETRI_PREVISIONE = {
+    'giorni_storico': (int, 1, 366),
+    'giorni_previsione': (int, 0, 90),
+    'passo_gradi': (float, 0, 1.0),
+    'top': (int, 0, 10000),
+}
+
+def leggi_parametri_previsione(data):
+    """Valida i parametri del body JSON. Solleva ValueError con un messaggio per il client."""
+    parametri = {}
+    for nome, (tipo, minimo, massimo) in PARAMETRI_PREVISIONE.items():
+        valore = data.get(nome)
+        if valore is None:
+            continue
+        # bool è un int per Python, ma "true" non è un numero di giorni
+        ammessi = (int, float) if tipo is float else (int,)
+        if isinstance(valore, bool) or not isinstance(valore, ammessi):
+            raise ValueError(f"'{nome}' deve essere un numero{' intero' if tipo is int else ''}")
+        if not minimo < valore <= massimo:
+            raise ValueError(f"'{nome}' deve essere maggiore di {minimo} e al massimo {massimo}")
+        parametri[nome] = tipo(valore)
+    return parametri
+
+# Genera le predizioni in modo sincrono, dentro il worker che serve la richiesta: con lo
+# storico di default su un DB grande può richiedere fino a un minuto, durante il quale
+# il worker non serve altro e il timeout del server (es. gunicorn --timeout) deve
+# coprirla. È pensata per rigenerazioni manuali dell'amministratore; le esecuzioni
+# pianificate passano da "flask genera-predizioni" (cron), fuori dai worker web.
+@app.route('/api/admin/predizioni/genera', methods=['POST'])
+@admin_required
+def genera_predizioni_api():
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Il body deve essere un oggetto JSON"}), 400
+    try:
+        parametri = leggi_parametri_previsione(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    inizio = time.perf_counter()
+    try:
+        periodo, salvate = genera_predizioni(id_amministratore=current_user.ID_Account, **parametri)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"status": "error", "message": str(e)}), 500
+    return jsonify({"status": "success", "periodo": periodo, "predizioni": salvate,
+                    "durata_s": round(time.perf_counter() - inizio, 3)})
+
+# Predizioni di un periodo (default: l'ultimo generato), paginate
+@app.route('/api/admin/predizioni', methods=['GET'])
+@admin_required
+@sola_lettura
+def get_predizioni():
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    per_pagina = min(max(request.args.get('per_pagina', 20, type=int), 1), 100)
+    periodo = request.args.get('periodo')
+    if not periodo:
+        ultima = PREDIZIONE.query.order_by(PREDIZIONE.ID_Predizione.desc()).first()
+        if not ultima:
+            return jsonify({"status": "success", "periodo": None, "pagina": pagina, "per_pagina": per_pagina, "totale": 0, "predizioni": []})
+        periodo = ultima.Periodo_Riferimento
+
+    query = PREDIZIONE.query.filter_by(Periodo_Riferimento=periodo)
+    totale = query.count()
+    predizioni = query.order_by(PREDIZIONE.ID_Predizione).offset((pagina - 1) * per_pagina).limit(per_pagina).all()
+
+    return jsonify({
+        "status": "success",
+        "periodo": periodo,
+        "pagina": pagina,
+        "per_pagina": per_pagina,
+        "totale": totale,
+        "predizioni": [{
+            "id": p.ID_Predizione,
+            "data": p.Data_Predizione.isoformat() if p.Data_Predizione else None,
+            "lat": float(p.Latitudine_Prevista),
+            "lng": float(p.Longitudine_Prevista),
+            "nil": p.NIL_Riferimento,
+            "domanda_prevista": float(p.Domanda_Prevista)
+        } for p in predizioni]
+    })
+
 # --- 6. COMANDO PER INIZIALIZZARE IL DB ---
 # Assicurati di avere 'from datetime import datetime' all'inizio del file app.py
 
@@ -566,6 +1193,412 @@ def reset_luca_password_command():
             print("ERRORE: Utente 'luca.verdi@email.it' non trovato nel database.")
 # =======================================================
 
+@app.cli.command("genera-predizioni")
+def genera_predizioni_command():
+    """Calcola le zone con più domanda prevista e le salva in PREDIZIONE."""
+    with app.app_context():
+        try:
+            inizio = time.perf_counter()
+            periodo, salvate = genera_predizioni()
+            print(f"Predizioni salvate per il periodo {periodo}: {salvate} ({time.perf_counter() - inizio:.1f} s).")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Errore durante la generazione delle predizioni: {e}")
+
+# --- 6.1 SCADENZA DELLE PRENOTAZIONI ---
+# Le prenotazioni 'attiva' con fine nel passato diventano 'scaduta' e le loro colonnine
+# tornano 'disponibile'; le colonnine con una prenotazione futura appena iniziata
+# passano a 'prenotata'. Tutto con UPDATE set-based su batch di ID limitati,
+# con un commit per batch: i lock sulle tabelle durano poco anche con molti arretrati.
+
+def _prenotazione_in_corso(adesso):
+    # Esiste una prenotazione attiva in corso (o che inizia entro inizio_imminente)
+    # sulla colonnina della riga esterna
+    return exists().where(
+        PRENOTAZIONE.ID_Colonnina == COLONNINA.ID_Colonnina,
+        PRENOTAZIONE.Stato == 'attiva',
+        PRENOTAZIONE.Data_Ora_Inizio_Prenotazione <= inizio_imminente(adesso),
+        PRENOTAZIONE.Data_Ora_Fine_Prenotazione > adesso
+    )
+
+def _libera_colonnine(id_colonnine, adesso):
+    if not id_colonnine:
+        return 0
+    risultato = db.session.execute(
+        update(COLONNINA)
+        .where(COLONNINA.ID_Colonnina.in_(id_colonnine))
+        .where(COLONNINA.Stato == 'prenotata')
+        .where(~_prenotazione_in_corso(adesso))
+        .values(Stato='disponibile')
+        .execution_options(synchronize_session=False)
+    )
+    return risultato.rowcount
+
+def _segna_colonnine_prenotate(id_colonnine, adesso):
+    if not id_colonnine:
+        return 0
+    risultato = db.session.execute(
+        update(COLONNINA)
+        .where(COLONNINA.ID_Colonnina.in_(id_colonnine))
+        .where(COLONNINA.Stato == 'disponibile')
+        .where(_prenotazione_in_corso(adesso))
+        .values(Stato='prenotata')
+        .execution_options(synchronize_session=False)
+    )
+    return risultato.rowcount
+
+def scadi_prenotazioni(adesso=None):
+    """
+    Esegue un giro del worker con lavoro limitato (SCADENZE_MAX_BATCH x SCADENZE_BATCH righe).
+    Restituisce il numero di prenotazioni scadute, di colonnine liberate e di colonnine prenotate.
+    """
+    adesso = adesso or datetime.now()
+    batch = app.config['SCADENZE_BATCH']
+    prenotazioni_scadute = 0
+    colonnine_liberate = 0
+
+    for _ in range(app.config['SCADENZE_MAX_BATCH']):
+        # Usa ix_prenotazione_stato_fine: range scan sulle sole attive già terminate
+        righe = db.session.execute(
+            select(PRENOTAZIONE.ID_Prenotazione, PRENOTAZIONE.ID_Colonnina)
+            .where(PRENOTAZIONE.Stato == 'attiva')
+            .where(PRENOTAZIONE.Data_Ora_Fine_Prenotazione <= adesso)
+            .order_by(PRENOTAZIONE.Data_Ora_Fine_Prenotazione)
+            .limit(batch)
+        ).all()
+        if not righe:
+            break
+
+        risultato = db.session.execute(
+            update(PRENOTAZIONE)
+            .where(PRENOTAZIONE.ID_Prenotazione.in_([r[0] for r in righe]))
+            .where(PRENOTAZIONE.Stato == 'attiva')
+            .values(Stato='scaduta')
+            .execution_options(synchronize_session=False)
+        )
+        prenotazioni_scadute += risultato.rowcount
+        colonnine_liberate += _libera_colonnine(list({r[1] for r in righe}), adesso)
+        db.session.commit()
+
+        if len(righe) < batch:
+            break
+
+    # Colonnine rimaste 'prenotata' senza alcuna prenotazione in corso (stati bloccati)
+    bloccate = db.session.execute(
+        select(COLONNINA.ID_Colonnina)
+        .where(COLONNINA.Stato == 'prenotata')
+        .where(~_prenotazione_in_corso(adesso))
+        .limit(batch)
+    ).scalars().all()
+    colonnine_liberate += _libera_colonnine(bloccate, adesso)
+    db.session.commit()
+
+    # Colonnine libere la cui prenotazione (fatta in anticipo) è appena iniziata.
+    # Una colonnina 'occupata' resta tale: la ricarica in corso ha la precedenza
+    da_prenotare = db.session.execute(
+        select(COLONNINA.ID_Colonnina)
+        .where(COLONNINA.Stato == 'disponibile')
+        .where(_prenotazione_in_corso(adesso))
+        .limit(batch)
+    ).scalars().all()
+    colonnine_prenotate = _segna_colonnine_prenotate(da_prenotare, adesso)
+    db.session.commit()
+
+    if prenotazioni_scadute or colonnine_liberate:
+        invalida_cache_api('colonnine')
+        invalida_indice_disponibilita()
+    elif colonnine_prenotate:
+        invalida_cache_api('colonnine') # Le prenotazioni non cambiano: l'indice resta valido
+    return prenotazioni_scadute, colonnine_liberate, colonnine_prenotate
+
+@app.cli.command("scadi-prenotazioni")
+def scadi_prenotazioni_command():
+    """Fa scadere le prenotazioni terminate, libera le colonnine e segna quelle appena prenotate (da lanciare con cron)."""
+    with app.app_context():
+        try:
+            scadute, liberate, prenotate = scadi_prenotazioni()
+            print(f"Prenotazioni scadute: {scadute}. Colonnine liberate: {liberate}. Colonnine prenotate: {prenotate}.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Errore durante la scadenza delle prenotazioni: {e}")
+
+def _ciclo_scadenze(intervallo):
+    while True:
+        time.sleep(intervallo)
+        with app.app_context():
+            try:
+                scadute, liberate, prenotate = scadi_prenotazioni()
+                if scadute or liberate or prenotate:
+                    print(f"[scadenze] Prenotazioni scadute: {scadute}. Colonnine liberate: {liberate}. "
+                          f"Colonnine prenotate: {prenotate}.")
+            except Exception as e:
+                db.session.rollback()
+                print(f"[scadenze] Errore: {e}")
+            finally:
+                db.session.remove()
+
+# Worker in background nel processo dell'app (se configurato). Con più processi
+# ognuno esegue il proprio ciclo: gli UPDATE sono idempotenti grazie ai filtri su Stato.
+# Parte alla prima richiesta e non all'import: i comandi flask (init-db, aggiorna-db...)
+# e il processo padre del reloader importano app.py ma non servono richieste.
+_worker_scadenze = None
+_worker_scadenze_lock = threading.Lock()
+
+def avvia_worker_scadenze():
+    global _worker_scadenze
+    if _worker_scadenze is None and app.config['SCADENZE_INTERVALLO_SECONDI'] > 0:
+        with _worker_scadenze_lock:
+            if _worker_scadenze is None:
+                _worker_scadenze = threading.Thread(
+                    target=_ciclo_scadenze, args=(app.config['SCADENZE_INTERVALLO_SECONDI'],),
+                    name='scadenze-prenotazioni', daemon=True
+                )
+                _worker_scadenze.start()
+    return _worker_scadenze
+
+@app.before_request
+def _avvia_worker_scadenze():
+    avvia_worker_scadenze()
+
+# --- 6.2 INGEST DELLE SESSIONI DI RICARICA ---
+# Le colonnine inviano gli eventi in NDJSON a /api/ingest/ricariche. Gli eventi
+# vengono uniti per sessione in un buffer in memoria (vedi ingest_ricariche.py) e un
+# thread li scrive a blocchi: INSERT multipli con ON DUPLICATE KEY UPDATE sulla
+# chiave di idempotenza, poi un solo UPDATE set-based dello Stato delle colonnine toccate.
+# Le sessioni ancora nel buffer si perdono se il processo muore: la colonnina
+# può reinviare gli eventi senza creare doppioni.
+
+RIGHE_PER_INSERT_INGEST = 1000
+_buffer_ingest = None
+_buffer_ingest_lock = threading.Lock()
+
+def _sessione_aperta():
+    # Esiste una ricarica senza fine sulla colonnina della riga esterna (usa ix_ricarica_colonnina_fine)
+    return exists().where(
+        RICARICA.ID_Colonnina == COLONNINA.ID_Colonnina,
+        RICARICA.Data_Ora_Fine.is_(None)
+    )
+
+def _upsert_ricariche(sessioni):
+    from sqlalchemy.dialects.mysql import insert as insert_mysql
+    righe = [{
+        "Chiave_Idempotenza": s['chiave'],
+        "ID_Colonnina": s['id_colonnina'],
+        "Data_Ora_Inizio": s['inizio'],
+        "Data_Ora_Fine": s['fine'],
+        "Energia_Erogata_kWh": s['energia_kwh'],
+        "ID_Utente": s['id_utente'],
+        "Targa_Auto": s['targa']
+    } for s in sessioni]
+    for i in range(0, len(righe), RIGHE_PER_INSERT_INGEST):
+        query = insert_mysql(RICARICA).values(righe[i:i + RIGHE_PER_INSERT_INGEST])
+        nuova = query.inserted
+        # Stesse regole dell'unione nel buffer: riapplicare un evento non cambia la riga
+        db.session.execute(query.on_duplicate_key_update(
+            Data_Ora_Inizio=func.least(RICARICA.Data_Ora_Inizio, nuova.Data_Ora_Inizio),
+            Data_Ora_Fine=func.coalesce(func.greatest(RICARICA.Data_Ora_Fine, nuova.Data_Ora_Fine), nuova.Data_Ora_Fine, RICARICA.Data_Ora_Fine),
+            Energia_Erogata_kWh=func.coalesce(func.greatest(RICARICA.Energia_Erogata_kWh, nuova.Energia_Erogata_kWh),
+                                              nuova.Energia_Erogata_kWh, RICARICA.Energia_Erogata_kWh),
+            ID_Utente=func.coalesce(RICARICA.ID_Utente, nuova.ID_Utente),
+            Targa_Auto=func.coalesce(RICARICA.Targa_Auto, nuova.Targa_Auto)
+        ))
+
+def _aggiorna_stato_colonnine(id_colonnine, adesso):
+    # Un solo UPDATE per tutte le colonnine toccate; 'manutenzione' non viene mai cambiata
+    risultato = db.session.execute(
+        update(COLONNINA)
+        .where(COLONNINA.ID_Colonnina.in_(id_colonnine))
+        .where(COLONNINA.Stato != 'manutenzione')
+        .values(Stato=case(
+            (_sessione_aperta(), 'occupata'),
+            (_prenotazione_in_corso(adesso), 'prenotata'),
+            else_='disponibile'
+        ))
+        .execution_options(synchronize_session=False)
+    )
+    return risultato.rowcount
+
+def _scarta_non_valide(sessioni):
+    # Una riga che viola un vincolo (colonnina, utente o targa inesistenti) fa fallire
+    # tutto l'INSERT: dividiamo a metà finché restano solo le righe valide. Ogni tentativo
+    # è in un SAVEPOINT: le metà valide restano nella transazione di scrivi_sessioni
+    if not sessioni:
+        return []
+    try:
+        with db.session.begin_nested():
+            _upsert_ricariche(sessioni)
+        return sessioni
+    except IntegrityError as e:
+        if len(sessioni) == 1:
+            print(f"[ingest] Sessione scartata {sessioni[0]['chiave']}: {e.orig}")
+            return []
+    meta = len(sessioni) // 2
+    return _scarta_non_valide(sessioni[:meta]) + _scarta_non_valide(sessioni[meta:])
+
+def scrivi_sessioni(sessioni):
+    """Scrive un blocco di sessioni dal buffer e aggiorna lo Stato delle colonnine (una transazione)."""
+    with app.app_context():
+        try:
+            try:
+                _upsert_ricariche(sessioni)
+            except IntegrityError:
+                db.session.rollback()
+                sessioni = _scarta_non_valide(sessioni)
+            id_colonnine = list({s['id_colonnina'] for s in sessioni})
+            stato_cambiato = bool(id_colonnine) and _aggiorna_stato_colonnine(id_colonnine, datetime.now()) > 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+    # Dopo il commit: chi rigenera la cache legge già le righe scritte
+    if sessioni:
+        invalida_cache_api('ricariche')
+    if stato_cambiato:
+        invalida_cache_api('colonnine')
+
+def buffer_ingest():
+    """Buffer del processo, creato (con il suo thread) alla prima richiesta di ingest."""
+    global _buffer_ingest
+    if _buffer_ingest is None:
+        with _buffer_ingest_lock:
+            if _buffer_ingest is None:
+                from ingest_ricariche import BufferRicariche
+                _buffer_ingest = BufferRicariche(
+                    scrivi_sessioni,
+                    max_sessioni=app.config['INGEST_MAX_SESSIONI'],
+                    intervallo=app.config['INGEST_INTERVALLO_SECONDI'],
+                    max_in_attesa=app.config['INGEST_MAX_IN_ATTESA']
+                ).avvia()
+    return _buffer_ingest
+
+def _token_ingest_valido():
+    intestazione = request.headers.get('Authorization', '')
+    token = intestazione[len('Bearer '):] if intestazione.startswith('Bearer ') else ''
+    import hmac
+    return hmac.compare_digest(token.encode('utf-8'), app.config['INGEST_TOKEN'].encode('utf-8'))
+
+# Body NDJSON (eventualmente con Content-Encoding: gzip), autenticato con "Authorization: Bearer <INGEST_TOKEN>".
+# Risponde 202: le righe valide sono nel buffer, quelle non valide sono elencate con il numero di riga.
+# Oltre INGEST_MAX_RIGHE eventi o INGEST_MAX_BYTE byte decompressi la richiesta è rifiutata (413);
+# se il buffer è pieno è rifiutata per intero (503) e va reinviata.
+@app.route('/api/ingest/ricariche', methods=['POST'])
+def ingest_ricariche():
+    if not app.config['INGEST_TOKEN']:
+        abort(404)
+    if not _token_ingest_valido():
+        return jsonify({"status": "error", "message": "Token non valido"}), 401
+
+    from ingest_ricariche import BufferPieno, RichiestaTroppoGrande, leggi_ndjson
+    flusso = request.stream
+    if request.headers.get('Content-Encoding') == 'gzip':
+        import gzip
+        flusso = gzip.GzipFile(fileobj=flusso)
+
+    try:
+        # Riga per riga dallo stream, con righe e byte limitati: la memoria usata
+        # da una richiesta è al massimo INGEST_MAX_RIGHE eventi
+        eventi, errori = leggi_ndjson(flusso, app.config['INGEST_MAX_RIGHE'], app.config['INGEST_MAX_BYTE'])
+    except RichiestaTroppoGrande as e:
+        return jsonify({"status": "error", "message": str(e)}), 413
+    except (OSError, EOFError):
+        return jsonify({"status": "error", "message": "Body gzip non valido"}), 400
+
+    try:
+        buffer_ingest().aggiungi(eventi)
+    except BufferPieno as e:
+        risposta = jsonify({"status": "error", "message": str(e)})
+        risposta.headers['Retry-After'] = str(max(1, int(app.config['INGEST_INTERVALLO_SECONDI'])))
+        return risposta, 503
+
+    return jsonify({
+        "status": "success",
+        "accettati": len(eventi),
+        "scartati": len(errori),
+        "errori": errori[:100] # Le prime righe non valide bastano per capire il problema
+    }), 202
+
+# Metriche dell'ingest di questo processo (eventi ricevuti, sessioni scritte, errori, buffer)
+@app.route('/api/admin/metriche/ingest', methods=['GET'])
+@admin_required
+def get_metriche_ingest():
+    if _buffer_ingest is None:
+        return jsonify({"status": "success", "attivo": False})
+    return jsonify({"status": "success", "attivo": True, **_buffer_ingest.stato()})
+
+# --- 6.3 AGGIORNAMENTO DELLO SCHEMA SENZA PERDITA DI DATI ---
+# init-db cancella e ricrea tutto. Su un DB già in uso si lancia invece
+# "flask aggiorna-db": confronta i modelli con lo schema reale e aggiunge solo
+# quello che manca (tabelle, colonne, indici e vincoli unique con nome).
+# Non elimina né modifica niente, quindi si può rilanciare a ogni deploy.
+# Con --dry-run stampa le istruzioni senza eseguirle.
+
+def istruzioni_aggiornamento_db(engine):
+    """Restituisce le istruzioni DDL (già compilate per il dialetto) che mancano rispetto ai modelli."""
+    ispettore = ispeziona(engine)
+    dialetto = engine.dialect
+    quota = dialetto.identifier_preparer.quote
+    esistenti = set(ispettore.get_table_names())
+    istruzioni = []
+
+    for tabella in db.metadata.sorted_tables:
+        if tabella.name not in esistenti:
+            istruzioni.append(str(CreateTable(tabella).compile(dialect=dialetto)).strip())
+            istruzioni += [str(CreateIndex(indice).compile(dialect=dialetto)) for indice in tabella.indexes]
+            continue
+
+        colonne = {c['name'] for c in ispettore.get_columns(tabella.name)}
+        for colonna in tabella.columns:
+            if colonna.name in colonne:
+                continue
+            if not colonna.nullable and colonna.server_default is None:
+                # Le righe esistenti non avrebbero un valore: serve una migrazione scritta a mano
+                print(f"ATTENZIONE: colonna {tabella.name}.{colonna.name} NOT NULL senza default, non aggiunta.")
+                continue
+            istruzioni.append(f"ALTER TABLE {quota(tabella.name)} ADD COLUMN {quota(colonna.name)} "
+                              f"{colonna.type.compile(dialect=dialetto)}")
+
+        indici = ispettore.get_indexes(tabella.name)
+        vincoli = ispettore.get_unique_constraints(tabella.name)
+        nomi = {i['name'] for i in indici} | {v['name'] for v in vincoli}
+        # Un unique già presente sulle stesse colonne (ad es. creato da un vecchio unique=True) basta
+        colonne_uniche = {tuple(i['column_names']) for i in indici if i.get('unique')} | \
+                         {tuple(v['column_names']) for v in vincoli}
+        for indice in tabella.indexes:
+            if indice.name not in nomi:
+                istruzioni.append(str(CreateIndex(indice).compile(dialect=dialetto)))
+        for vincolo in tabella.constraints:
+            if not isinstance(vincolo, db.UniqueConstraint) or vincolo.name is None:
+                continue
+            if vincolo.name in nomi or tuple(c.name for c in vincolo.columns) in colonne_uniche:
+                continue
+            istruzioni.append(f"CREATE UNIQUE INDEX {quota(vincolo.name)} ON {quota(tabella.name)} "
+                              f"({', '.join(quota(c.name) for c in vincolo.columns)})")
+    return istruzioni
+
+@app.cli.command("aggiorna-db")
+@click.option('--dry-run', is_flag=True, help="Stampa le istruzioni senza eseguirle.")
+def aggiorna_db_command(dry_run):
+    """Aggiunge tabelle, colonne e indici mancanti senza toccare i dati (per DB già in uso)."""
+    with app.app_context():
+        istruzioni = istruzioni_aggiornamento_db(db.engine)
+        if not istruzioni:
+            print("Lo schema è già aggiornato.")
+            return
+        for istruzione in istruzioni:
+            print(istruzione + ";")
+            if dry_run:
+                continue
+            try:
+                # Una transazione per istruzione: su MySQL il DDL fa comunque commit implicito
+                with db.engine.begin() as connessione:
+                    connessione.execute(db.text(istruzione))
+            except Exception as e:
+                print(f"Errore, aggiornamento interrotto: {e}")
+                return
+        print("Istruzioni da eseguire: " if dry_run else "Istruzioni eseguite: ", len(istruzioni), sep="")
+
 # --- 7. AVVIO APPLICAZIONE ---
 if __name__ == '__main__':
     # '0.0.0.0' è necessario per esporre il server in un Codespace
@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import pytest
+
+# --- CONFIGURAZIONE COMUNE DEI TEST ---
+# app.py legge la configurazione dall'ambiente quando viene importato: prima di
+# qualsiasi import puntiamo l'app a un DB SQLite temporaneo, così i test delle
+# rotte girano senza MySQL e non toccano mai il DB di sviluppo del file .env
+# (load_dotenv non sovrascrive le variabili già impostate).
+
+_CARTELLA_DB = tempfile.mkdtemp(prefix='test-app-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_CARTELLA_DB, 'test.db')}"
+os.environ.pop('DATABASE_REPLICA_URL', None)
+os.environ['SECRET_KEY'] = 'chiave-dei-test'
+os.environ['SCADENZE_INTERVALLO_SECONDI'] = '0'
+os.environ['PASSWORD_HASH_METODO'] = 'pbkdf2:sha256:20000' # Abbastanza costoso da misurare, abbastanza veloce per i test
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_CARTELLA_DB, ignore_errors=True)
+
+
+@pytest.fixture
+def app_test():
+    """Il modulo app con le tabelle create su SQLite, vuote a ogni test."""
+    import app as modulo
+    modulo.app.config['TESTING'] = True
+    with modulo.app.app_context():
+        modulo.db.create_all()
+    yield modulo
+    with modulo.app.app_context():
+        modulo.db.session.remove()
+        modulo.db.drop_all()
+    modulo.invalida_cache_api()
+    modulo.invalida_indice_disponibilita()
+
+
+def crea_utente(modulo, email, password='password', targa=None):
+    """Crea ACCOUNT + UTENTE (+ AUTO se c'è la targa). Restituisce l'ID dell'account."""
+    with modulo.app.app_context():
+        account = modulo.ACCOUNT(Email=email, Tipo_Account='utente')
+        account.set_password(password)
+        modulo.db.session.add(account)
+        modulo.db.session.flush()
+        modulo.db.session.add(modulo.UTENTE(ID_Utente=account.ID_Account, Nome='Mario', Cognome='Rossi',
+                                            Codice_Fiscale=f'CF{account.ID_Account:014d}'))
+        if targa:
+            modulo.db.session.add(modulo.AUTO(Targa=targa, Marca='Fiat', Modello='500e', ID_Utente=account.ID_Account))
+        modulo.db.session.commit()
+        return account.ID_Account
+
+
+def accedi(client, id_account):
+    """Sessione di Flask-Login già autenticata, senza passare da /login."""
+    with client.session_transaction() as sessione:
+        sessione['_user_id'] = str(id_account)
+        sessione['_fresh'] = True
@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+from sqlalchemy.pool import QueuePool
+
+# --- CONFIGURAZIONE POOL DI CONNESSIONI (condivisa da app.py e train_model.py) ---
+
+# Tempi di attesa per ottenere una connessione dal pool, per nome del pool
+_metriche = {}
+_metriche_lock = threading.Lock()
+
+
+class QueuePoolConMetriche(QueuePool):
+    """
+    QueuePool che misura quanto si resta in attesa al checkout di una connessione.
+    Se il pool è saturo l'attesa cresce: è il segnale che pool_size/max_overflow sono bassi.
+    """
+
+    nome = 'primary'
+
+    def _do_get(self):
+        inizio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            registra_attesa(self.nome, time.perf_counter() - inizio)
+
+
+def crea_classe_pool(nome):
+    # Una sottoclasse per engine, così primary e replica hanno metriche separate
+    return type(f'QueuePoolConMetriche_{nome}', (QueuePoolConMetriche,), {'nome': nome})
+
+
+def registra_attesa(nome, secondi):
+    with _metriche_lock:
+        m = _metriche.setdefault(nome, {'checkout': 0, 'attesa_totale_s': 0.0, 'attesa_max_s': 0.0})
+        m['checkout'] += 1
+        m['attesa_totale_s'] += secondi
+        m['attesa_max_s'] = max(m['attesa_max_s'], secondi)
+
+
+def metriche_pool():
+    """Restituisce una copia delle metriche di attesa al checkout, con la media in millisecondi."""
+    with _metriche_lock:
+        risultato = {}
+        for nome, m in _metriche.items():
+            media = m['attesa_totale_s'] / m['checkout'] if m['checkout'] else 0.0
+            risultato[nome] = {
+                'checkout': m['checkout'],
+                'attesa_media_ms': round(media * 1000, 3),
+                'attesa_max_ms': round(m['attesa_max_s'] * 1000, 3),
+            }
+        return risultato
+
+
+def opzioni_engine(nome='primary'):
+    """
+    Opzioni per create_engine lette dall'ambiente (.env).
+    pool_recycle deve restare sotto il wait_timeout di MySQL, altrimenti
+    il server chiude le connessioni inattive e la prima query fallisce.
+    """
+    return {
+        'poolclass': crea_classe_pool(nome),
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') != '0',
+    }
@@ -0,0 +1,117 @@
+import math
+import threading
+from datetime import datetime, timedelta
+
+# --- INDICE DI DISPONIBILITÀ DELLE COLONNINE ---
+# Per ogni colonnina teniamo una bitmap di occupazione a intervalli fissi
+# (es. 15 minuti) su un orizzonte limitato (es. 7 giorni): il bit i è a 1 se
+# l'intervallo i è coperto da una prenotazione attiva. Verificare se una
+# finestra è libera diventa un AND con una maschera, senza scorrere le prenotazioni.
+# La bitmap è un int Python: per 7 giorni a 15 minuti sono 672 bit per colonnina.
+
+
+class IndiceDisponibilita:
+
+    def __init__(self, origine, bucket_minuti=15, orizzonte_giorni=7):
+        self.bucket = timedelta(minutes=bucket_minuti)
+        # Allineiamo l'origine all'inizio del suo intervallo
+        self.origine = origine.replace(second=0, microsecond=0) - timedelta(minutes=origine.minute % bucket_minuti)
+        self.n_bucket = orizzonte_giorni * 24 * 60 // bucket_minuti
+        self.fine_orizzonte = self.origine + self.n_bucket * self.bucket
+        self.creato = datetime.now()
+        self._occupazione = {}   # ID_Colonnina -> bitmap (int)
+        self._colonnine = {}     # ID_Colonnina -> (lat, lng, nil, stato)
+        self._lock = threading.Lock()
+
+    # --- Costruzione ---
+
+    def aggiungi_colonnina(self, id_colonnina, lat, lng, nil, stato):
+        with self._lock:
+            self._colonnine[id_colonnina] = (float(lat), float(lng), nil, stato)
+            self._occupazione.setdefault(id_colonnina, 0)
+
+    def segna_prenotazione(self, id_colonnina, inizio, fine):
+        """Marca come occupati gli intervalli toccati da [inizio, fine)."""
+        maschera = self._maschera(inizio, fine)
+        if not maschera:
+            return
+        with self._lock:
+            self._occupazione[id_colonnina] = self._occupazione.get(id_colonnina, 0) | maschera
+
+    # --- Interrogazione ---
+
+    def copre(self, inizio, fine):
+        return self.origine <= inizio < fine <= self.fine_orizzonte
+
+    def candidati(self, lat=None, lng=None, raggio_km=None, nil=None):
+        """
+        Coppie (ID, distanza_km) delle colonnine prenotabili (non in manutenzione),
+        filtrate per NIL o per raggio da (lat, lng) e ordinate dalla più vicina.
+        """
+        risultato = []
+        for id_colonnina, (c_lat, c_lng, c_nil, stato) in self._colonnine.items():
+            if stato == 'manutenzione':
+                continue
+            if nil is not None and c_nil != nil:
+                continue
+            distanza = None
+            if lat is not None and lng is not None:
+                distanza = distanza_km(lat, lng, c_lat, c_lng)
+                if raggio_km is not None and distanza > raggio_km:
+                    continue
+            risultato.append((distanza if distanza is not None else 0.0, id_colonnina))
+        risultato.sort()
+        return [(id_colonnina, distanza) for distanza, id_colonnina in risultato]
+
+    def libera(self, id_colonnina, inizio, fine):
+        """True se nessun intervallo di [inizio, fine) è occupato."""
+        return (self._occupazione.get(id_colonnina, 0) & self._maschera(inizio, fine)) == 0
+
+    def fasce_libere(self, id_colonnina, inizio, fine, durata_minima=None):
+        """
+        Elenco di (inizio, fine) liberi dentro la finestra, lunghi almeno durata_minima.
+        Le fasce sono tagliate sulla finestra richiesta: gli intervalli ai bordi
+        vengono allineati alla griglia, ma una fascia non esce mai da [inizio, fine).
+        """
+        primo, ultimo = self._indici(inizio, fine)
+        occupazione = self._occupazione.get(id_colonnina, 0) >> primo
+
+        fasce = []
+        inizio_fascia = None
+        for i in range(ultimo - primo + 1):
+            occupato = i == ultimo - primo or (occupazione >> i) & 1
+            if not occupato and inizio_fascia is None:
+                inizio_fascia = i
+            elif occupato and inizio_fascia is not None:
+                da = max(self._istante(primo + inizio_fascia), inizio)
+                a = min(self._istante(primo + i), fine)
+                # La durata minima si controlla dopo il taglio sulla finestra
+                if a > da and (not durata_minima or a - da >= durata_minima):
+                    fasce.append((da, a))
+                inizio_fascia = None
+        return fasce
+
+    def colonnina(self, id_colonnina):
+        return self._colonnine.get(id_colonnina)
+
+    # --- Conversione istanti <-> intervalli ---
+
+    def _indici(self, inizio, fine):
+        # Un intervallo è toccato se si sovrappone anche solo in parte
+        primo = max(0, (inizio - self.origine) // self.bucket)
+        ultimo = min(self.n_bucket, math.ceil((fine - self.origine) / self.bucket))
+        return primo, max(primo, ultimo)
+
+    def _maschera(self, inizio, fine):
+        primo, ultimo = self._indici(inizio, fine)
+        return ((1 << (ultimo - primo)) - 1) << primo
+
+    def _istante(self, indice):
+        return self.origine + indice * self.bucket
+
+
+def distanza_km(lat1, lng1, lat2, lng2):
+    # Approssimazione equirettangolare: più che sufficiente sulle distanze di una città
+    x = math.radians(lng2 - lng1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return 6371.0 * math.hypot(x, y)
@@ -0,0 +1,223 @@
+import os
+import threading
+
+# --- SHARED INFERENCE CORE ---
+# Model loading, input validation and prediction used by prediction_server.py,
+# prediction_ui_server.py, prediction_server_async.py and (optionally) app.py.
+# Keeping it in one place means one loaded model per process and one place to optimize.
+
+DEFAULT_MODEL_FILENAME = 'model.pkl'
+
+# Define the expected feature names (must match training)
+EXPECTED_FEATURES = ['Potenza_kW', 'NIL', 'RicaricheMedieGiornaliere', 'DurataMediaMinuti', 'EnergiaMediaKWh']
+NUMERIC_FEATURES = ['Potenza_kW', 'RicaricheMedieGiornaliere', 'DurataMediaMinuti', 'EnergiaMediaKWh']
+CATEGORICAL_FEATURES = ['NIL']
+
+# Sample input used to exercise the whole pipeline once before real traffic
+WARM_UP_RECORD = {'Potenza_kW': 22.0, 'NIL': 'Sconosciuto', 'RicaricheMedieGiornaliere': 0.0,
+                  'DurataMediaMinuti': 0.0, 'EnergiaMediaKWh': 0.0}
+
+
+class InvalidInput(ValueError):
+    """The request data cannot be turned into model features (client error)."""
+
+
+class ModelNotAvailable(RuntimeError):
+    """The model file is missing or could not be loaded (server error)."""
+
+
+# --- 1. MODEL REGISTRY ---
+
+class ModelRegistry:
+    """
+    Loads each model file once per process and shares it between all users.
+    If the file on disk changes (e.g. after running train_model.py) it is reloaded.
+    A directory is treated as a registro_modelli registry: its LATEST version is
+    served, and a new version is picked up as soon as LATEST is switched.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._failed = {}   # filename -> (path, mtime) of the last version that failed to load
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def resolve(filename):
+        if os.path.isdir(filename):
+            from registro_modelli import percorso_modello
+            path = percorso_modello(filename)
+            if path is None:
+                raise ModelNotAvailable(f"Nessuna versione nel registro '{filename}'. "
+                                        "Esegui prima lo script 'retrain_model.py'.")
+            return path
+        return filename
+
+    def get(self, filename):
+        """
+        The model for filename, reloaded when the file changes. If the new file
+        cannot be read (missing, or still being written) the version already in
+        memory keeps being served; without one, ModelNotAvailable is raised.
+        """
+        cached = self._models.get(filename)
+        try:
+            path = self.resolve(filename)
+            mtime = os.path.getmtime(path)
+        except (OSError, ModelNotAvailable) as e:
+            if cached is not None:
+                return cached[2]
+            if isinstance(e, ModelNotAvailable):
+                raise
+            raise ModelNotAvailable(f"File del modello '{filename}' non trovato. "
+                                    "Assicurati di aver eseguito prima lo script 'train_model.py'.")
+
+        if cached is not None and (cached[:2] == (path, mtime) or self._failed.get(filename) == (path, mtime)):
+            return cached[2]
+
+        with self._lock:
+            cached = self._models.get(filename)
+            if cached is not None and (cached[:2] == (path, mtime) or self._failed.get(filename) == (path, mtime)):
+                return cached[2]
+            import joblib # Deferred: only the process that really predicts pays for it
+            try:
+                model = joblib.load(path)
+            except Exception as e:
+                if cached is None:
+                    raise ModelNotAvailable(f"Errore durante il caricamento del modello: {e}")
+                # Don't retry this same file on every request: only when it changes again
+                self._failed[filename] = (path, mtime)
+                print(f"Errore durante il caricamento di '{path}', continuo con '{cached[0]}': {e}")
+                return cached[2]
+            # One entry per name: the previous version is released
+            self._models[filename] = (path, mtime, model)
+            self._failed.pop(filename, None)
+            print(f"Modello '{path}' caricato con successo.")
+            return model
+
+
+registry = ModelRegistry()
+
+
+# --- 2. VALIDATION ---
+
+def missing_features(records):
+    """Feature names absent from at least one of the input records."""
+    return [feature for feature in EXPECTED_FEATURES if any(feature not in record for record in records)]
+
+
+def validate(records):
+    """
+    Turns a list of input dicts into the DataFrame the model expects.
+    Type coercion is done per column on the whole batch, not record by record.
+    Raises InvalidInput with the same messages the servers always returned.
+    """
+    import pandas as pd
+
+    if not records:
+        raise InvalidInput("Nessun dato JSON ricevuto.")
+    if not all(isinstance(record, dict) for record in records):
+        raise InvalidInput("Formato dati non valido: attesi oggetti JSON.")
+
+    missing = missing_features(records)
+    if missing:
+        raise InvalidInput(f"Dati mancanti: {', '.join(missing)}")
+
+    # Ensure the order of columns matches EXPECTED_FEATURES
+    input_df = pd.DataFrame.from_records(records, columns=EXPECTED_FEATURES)
+    try:
+        input_df[NUMERIC_FEATURES] = input_df[NUMERIC_FEATURES].apply(pd.to_numeric)
+        input_df[CATEGORICAL_FEATURES] = input_df[CATEGORICAL_FEATURES].astype(str)
+    except (ValueError, TypeError) as ve:
+        raise InvalidInput(f"Errore nella conversione dei tipi di dati: {ve}")
+    return input_df
+
+
+# --- 3. PREDICTOR ---
+
+class Predictor:
+    """Validates input and runs the model pipeline (preprocessor + classifier)."""
+
+    def __init__(self, model_filename=DEFAULT_MODEL_FILENAME, model_registry=registry):
+        self.model_filename = model_filename
+        self.registry = model_registry
+        self.warm = False
+        self.warm_up_error = None
+
+    @property
+    def model(self):
+        return self.registry.get(self.model_filename)
+
+    def warm_up(self):
+        """
+        Loads the model and runs one prediction, so the first real request
+        does not pay for unpickling and lazy imports. Returns True if ready.
+        """
+        try:
+            self.predict([WARM_UP_RECORD])
+        except Exception as e:
+            print(f"ERRORE: warm-up del modello fallito: {e}")
+            self.warm = False
+            self.warm_up_error = str(e)
+            return False
+        self.warm = True
+        self.warm_up_error = None
+        return True
+
+    def warm_up_in_background(self):
+        """
+        Runs warm_up() in a daemon thread, so the server binds its socket and
+        answers /ready while pandas, joblib and the model are still loading.
+        """
+        thread = threading.Thread(target=self.warm_up, name='model-warm-up', daemon=True)
+        thread.start()
+        return thread
+
+    def predict(self, records):
+        """Returns one predicted class ('basso', 'medio', 'alto') per input record."""
+        model = self.model
+        input_df = validate(records)
+        return [str(prediction) for prediction in model.predict(input_df)]
+
+
+# --- 4. FLASK ROUTE ---
+
+def create_predict_blueprint(predictor):
+    """
+    Blueprint with the POST /predict endpoint, shared by all Flask servers.
+    Accepts a single JSON object (-> predicted_usage_level) or a list of
+    objects (-> predicted_usage_levels), predicted in one batch.
+    GET /ready answers 200 only once the model is loaded and warm.
+    """
+    from flask import Blueprint, request, jsonify
+
+    blueprint = Blueprint('predict', __name__)
+
+    @blueprint.route('/ready', methods=['GET'])
+    def readiness():
+        if predictor.warm:
+            return jsonify({"status": "ready", "model": predictor.model_filename})
+        if predictor.warm_up_error:
+            return jsonify({"status": "error", "message": predictor.warm_up_error}), 503
+        return jsonify({"status": "warming_up"}), 503
+
+    @blueprint.route('/predict', methods=['POST'])
+    def predict_usage():
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"error": "Nessun dato JSON ricevuto."}), 400
+
+        is_batch = isinstance(data, list)
+        try:
+            predictions = predictor.predict(data if is_batch else [data])
+        except InvalidInput as e:
+            return jsonify({"error": str(e)}), 400
+        except ModelNotAvailable as e:
+            return jsonify({"error": f"Modello non caricato correttamente. Impossibile fare predizioni. {e}"}), 500
+        except Exception as e:
+            print(f"Errore durante la predizione: {e}") # Log the error server-side
+            return jsonify({"error": f"Errore interno del server durante la predizione: {str(e)}"}), 500
+
+        if is_batch:
+            return jsonify({"predicted_usage_levels": predictions})
+        return jsonify({"predicted_usage_level": predictions[0]})
+
+    return blueprint
@@ -0,0 +1,245 @@
+import atexit
+import json
+import threading
+import time
+from datetime import datetime
+
+# --- INGEST DELLA TELEMETRIA DELLE COLONNINE ---
+# Le colonnine inviano eventi di sessione in NDJSON (un oggetto JSON per riga):
+#
+#   {"id_sessione": "A1-000123", "tipo": "inizio", "id_colonnina": 12, "istante": "2025-10-23T10:00:00",
+#    "id_utente": 5, "targa": "AB123CD"}
+#   {"id_sessione": "A1-000123", "tipo": "energia", "id_colonnina": 12, "istante": "...", "energia_kwh": 3.2}
+#   {"id_sessione": "A1-000123", "tipo": "fine", "id_colonnina": 12, "istante": "...", "energia_kwh": 18.4}
+#
+# Gli eventi vengono uniti in memoria per sessione (chiave di idempotenza
+# "<id_colonnina>:<id_sessione>") e scritti a blocchi da un thread dedicato,
+# quando il buffer raggiunge max_sessioni oppure ogni intervallo secondi.
+# Reinviare lo stesso evento non cambia il risultato: l'unione prende il minimo
+# degli istanti per l'inizio, l'ultimo 'fine' e il massimo dell'energia.
+# La memoria è limitata in due punti: ogni richiesta ha un massimo di righe e di
+# byte (anche dopo la decompressione gzip) e il buffer rifiuta una richiesta
+# intera se le sue sessioni nuove supererebbero max_in_attesa.
+
+TIPI_EVENTO = ('inizio', 'energia', 'fine')
+LUNGHEZZA_MAX_ID_SESSIONE = 48
+LUNGHEZZA_MAX_RIGA = 4096 # Byte: un evento valido ne occupa poche centinaia
+
+
+class EventoNonValido(ValueError):
+    """Riga NDJSON non interpretabile come evento di sessione."""
+
+
+class BufferPieno(RuntimeError):
+    """Troppe sessioni in attesa di scrittura: il client deve riprovare più tardi."""
+
+
+class RichiestaTroppoGrande(ValueError):
+    """Il body supera il massimo di righe o di byte di una richiesta."""
+
+
+def _istante(valore):
+    try:
+        istante = datetime.fromisoformat(valore)
+    except (TypeError, ValueError):
+        raise EventoNonValido("'istante' deve essere una data ISO 8601")
+    if istante.tzinfo is not None:
+        istante = istante.astimezone().replace(tzinfo=None) # Ora locale naive, come nel DB
+    return istante
+
+
+def leggi_evento(riga):
+    """Converte una riga NDJSON in un evento normalizzato. Solleva EventoNonValido."""
+    try:
+        dati = json.loads(riga)
+    except ValueError:
+        raise EventoNonValido("JSON non valido")
+    if not isinstance(dati, dict):
+        raise EventoNonValido("ogni riga deve essere un oggetto JSON")
+
+    id_sessione = dati.get('id_sessione')
+    if not isinstance(id_sessione, str) or not 0 < len(id_sessione) <= LUNGHEZZA_MAX_ID_SESSIONE:
+        raise EventoNonValido(f"'id_sessione' deve essere una stringa di 1-{LUNGHEZZA_MAX_ID_SESSIONE} caratteri")
+    if dati.get('tipo') not in TIPI_EVENTO:
+        raise EventoNonValido(f"'tipo' deve essere uno tra: {', '.join(TIPI_EVENTO)}")
+    id_colonnina = dati.get('id_colonnina')
+    if not isinstance(id_colonnina, int) or isinstance(id_colonnina, bool) or id_colonnina <= 0:
+        raise EventoNonValido("'id_colonnina' deve essere un intero positivo")
+
+    energia = dati.get('energia_kwh')
+    if energia is not None:
+        if not isinstance(energia, (int, float)) or isinstance(energia, bool) or energia < 0:
+            raise EventoNonValido("'energia_kwh' deve essere un numero non negativo")
+        energia = float(energia)
+    id_utente = dati.get('id_utente')
+    if id_utente is not None and (not isinstance(id_utente, int) or isinstance(id_utente, bool)):
+        raise EventoNonValido("'id_utente' deve essere un intero")
+    targa = dati.get('targa')
+    if targa is not None and (not isinstance(targa, str) or len(targa) > 10):
+        raise EventoNonValido("'targa' deve essere una stringa di massimo 10 caratteri")
+
+    return {
+        'chiave': f"{id_colonnina}:{id_sessione}",
+        'tipo': dati['tipo'],
+        'id_colonnina': id_colonnina,
+        'istante': _istante(dati.get('istante')),
+        'energia_kwh': energia,
+        'id_utente': id_utente,
+        'targa': targa
+    }
+
+
+def leggi_ndjson(flusso, max_righe, max_byte, max_byte_riga=LUNGHEZZA_MAX_RIGA):
+    """
+    Legge un body NDJSON da uno stream binario, una riga alla volta.
+    Restituisce (eventi validi, errori per riga). Solleva RichiestaTroppoGrande appena
+    si superano max_righe, max_byte in totale o max_byte_riga in una riga: con un body
+    gzip il limite vale sui byte decompressi, quindi un "gzip bomb" si ferma subito.
+    """
+    eventi = []
+    errori = []
+    letti = 0
+    numero = 0
+    while True:
+        riga = flusso.readline(max_byte_riga + 1)
+        if not riga:
+            break
+        numero += 1
+        letti += len(riga)
+        if numero > max_righe:
+            raise RichiestaTroppoGrande(f"Troppe righe: massimo {max_righe} eventi per richiesta")
+        if letti > max_byte:
+            raise RichiestaTroppoGrande(f"Body troppo grande: massimo {max_byte} byte (decompressi)")
+        if len(riga) > max_byte_riga and not riga.endswith(b'\n'):
+            raise RichiestaTroppoGrande(f"Riga {numero} troppo lunga: massimo {max_byte_riga} byte")
+        if not riga.strip():
+            continue
+        try:
+            eventi.append(leggi_evento(riga))
+        except EventoNonValido as e:
+            errori.append({"riga": numero, "errore": str(e)})
+    return eventi, errori
+
+
+def _sessione(evento):
+    # Ogni evento arriva dopo l'inizio della sessione: il suo istante è un inizio
+    # provvisorio valido anche se l'evento 'inizio' non è ancora arrivato
+    return {
+        'chiave': evento['chiave'],
+        'id_colonnina': evento['id_colonnina'],
+        'inizio': evento['istante'],
+        'fine': evento['istante'] if evento['tipo'] == 'fine' else None,
+        'energia_kwh': evento['energia_kwh'],
+        'id_utente': evento['id_utente'],
+        'targa': evento['targa']
+    }
+
+
+def _unisci(a, b):
+    """Unisce due versioni della stessa sessione (l'ordine non conta)."""
+    fini = [f for f in (a['fine'], b['fine']) if f is not None]
+    energie = [e for e in (a['energia_kwh'], b['energia_kwh']) if e is not None]
+    return {
+        'chiave': a['chiave'],
+        'id_colonnina': a['id_colonnina'],
+        'inizio': min(a['inizio'], b['inizio']),
+        'fine': max(fini) if fini else None,
+        'energia_kwh': max(energie) if energie else None, # L'energia erogata è cumulativa
+        'id_utente': a['id_utente'] or b['id_utente'],
+        'targa': a['targa'] or b['targa']
+    }
+
+
+class BufferRicariche:
+    """
+    Buffer delle sessioni in attesa di scrittura, condiviso dalle richieste del processo.
+    scrivi(sessioni) riceve la lista delle sessioni unite e le salva; se solleva
+    un'eccezione le sessioni tornano nel buffer e vengono riprovate al giro successivo.
+    """
+
+    def __init__(self, scrivi, max_sessioni=5000, intervallo=1.0, max_in_attesa=100000):
+        self.scrivi = scrivi
+        self.max_sessioni = max_sessioni
+        self.intervallo = intervallo
+        self.max_in_attesa = max_in_attesa
+        self._sessioni = {}   # chiave -> sessione unita
+        self._lock = threading.Lock()
+        self._sveglia = threading.Event()
+        self._scrittura = threading.Lock() # Una sola scrittura alla volta (thread o chiudi())
+        self._thread = None
+        self._chiuso = False
+        self.metriche = {'eventi_ricevuti': 0, 'sessioni_scritte': 0, 'scritture': 0, 'errori': 0, 'ultimo_errore': None}
+
+    def avvia(self):
+        self._thread = threading.Thread(target=self._ciclo, name='ingest-ricariche', daemon=True)
+        self._thread.start()
+        atexit.register(self.chiudi) # Allo spegnimento scriviamo quello che resta
+        return self
+
+    def aggiungi(self, eventi):
+        """
+        Aggiunge eventi già validati, tutti o nessuno. Solleva BufferPieno se le sessioni
+        nuove porterebbero il buffer oltre max_in_attesa (la scrittura è troppo indietro).
+        """
+        chiavi = {evento['chiave'] for evento in eventi}
+        with self._lock:
+            nuove = len(chiavi - self._sessioni.keys())
+            if len(self._sessioni) + nuove > self.max_in_attesa:
+                raise BufferPieno("Troppe sessioni in attesa di scrittura, riprova tra poco.")
+            for evento in eventi:
+                sessione = _sessione(evento)
+                precedente = self._sessioni.get(evento['chiave'])
+                self._sessioni[evento['chiave']] = _unisci(precedente, sessione) if precedente else sessione
+            self.metriche['eventi_ricevuti'] += len(eventi)
+            pieno = len(self._sessioni) >= self.max_sessioni
+        if pieno:
+            self._sveglia.set()
+
+    def in_attesa(self):
+        with self._lock:
+            return len(self._sessioni)
+
+    def svuota(self):
+        """Scrive subito tutte le sessioni in attesa. Restituisce quante ne ha scritte."""
+        with self._scrittura:
+            with self._lock:
+                sessioni, self._sessioni = self._sessioni, {}
+            if not sessioni:
+                return 0
+            try:
+                self.scrivi(list(sessioni.values()))
+            except Exception as e:
+                # Rimettiamo le sessioni nel buffer unendole a quelle arrivate nel frattempo
+                with self._lock:
+                    for chiave, sessione in sessioni.items():
+                        nuova = self._sessioni.get(chiave)
+                        self._sessioni[chiave] = _unisci(sessione, nuova) if nuova else sessione
+                    self.metriche['errori'] += 1
+                    self.metriche['ultimo_errore'] = f"{datetime.now().isoformat(timespec='seconds')} {e}"
+                raise
+            with self._lock:
+                self.metriche['sessioni_scritte'] += len(sessioni)
+                self.metriche['scritture'] += 1
+            return len(sessioni)
+
+    def _ciclo(self):
+        while not self._chiuso:
+            self._sveglia.wait(self.intervallo)
+            self._sveglia.clear()
+            try:
+                self.svuota()
+            except Exception as e:
+                print(f"[ingest] Errore di scrittura, riprovo: {e}")
+                time.sleep(self.intervallo) # Non martelliamo il DB se è giù
+
+    def chiudi(self):
+        self._chiuso = True
+        self._sveglia.set()
+        try:
+            self.svuota()
+        except Exception as e:
+            print(f"[ingest] Sessioni non scritte alla chiusura: {self.in_attesa()} ({e})")
+
+    def stato(self):
+        with self._lock:
+            return {**self.metriche, 'sessioni_in_attesa': len(self._sessioni)}
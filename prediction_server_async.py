@@ -0,0 +1,220 @@
+import os
+import json
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dotenv import load_dotenv
+from inference import EXPECTED_FEATURES, Predictor, missing_features
+
+# --- 1. CONFIGURATION ---
+# ASGI alternative to prediction_server.py, with the same /predict contract.
+# Requests are accepted on the event loop, inference runs in a pool of worker
+# processes that each hold a preloaded copy of the model, so a slow prediction
+# never blocks the other requests.
+#
+# Run with: uvicorn prediction_server_async:app --host 0.0.0.0 --port 5001
+
+load_dotenv()
+
+MODEL_FILENAME = os.environ.get('MODEL_FILENAME', 'model.pkl')
+WORKERS = int(os.environ.get('PREDICTION_WORKERS', os.cpu_count() or 1))
+# Max predictions queued or running at once; beyond this we answer 429
+MAX_QUEUE_DEPTH = int(os.environ.get('PREDICTION_MAX_QUEUE', WORKERS * 4))
+# Max seconds a client waits for its prediction; beyond this we answer 504
+REQUEST_TIMEOUT = float(os.environ.get('PREDICTION_TIMEOUT', 5.0))
+MAX_BODY_BYTES = 64 * 1024
+
+# --- 2. WORKER PROCESS SIDE ---
+
+_worker_predictor = None
+
+def _init_worker(model_filename):
+    """Runs once in every worker process: load and warm the model before any request arrives."""
+    global _worker_predictor
+    _worker_predictor = Predictor(model_filename)
+    _worker_predictor.warm_up()
+
+def _warm_up():
+    return _worker_predictor is not None and _worker_predictor.warm
+
+def _predict(data):
+    """Runs in a worker process. Raises InvalidInput (a ValueError) for bad input types."""
+    return _worker_predictor.predict([data])[0]
+
+# --- 3. EVENT LOOP SIDE ---
+
+class PredictionService:
+    """Owns the process pool and tracks how many predictions are in flight."""
+
+    def __init__(self):
+        self.executor = None
+        self.in_flight = 0
+        self.model_ready = False
+        self._warm_up_task = None
+
+    async def start(self):
+        """
+        Creates the pool and warms the workers in the background: startup completes
+        (and the server binds its socket) without waiting for the model to load.
+        """
+        self._start_pool()
+
+    def _start_pool(self):
+        self.executor = ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker, initargs=(MODEL_FILENAME,))
+        self._warm_up_task = asyncio.create_task(self._warm_up_workers())
+
+    def _restart_pool(self, broken):
+        """
+        A worker process died (OOM, segfault) and the pool is unusable: every later submit
+        would fail. Replace it and warm up again; /ready answers 503 until the model is back.
+        """
+        if broken is not self.executor:
+            return # Another request already replaced it
+        print("ERRORE: un worker di predizione è terminato. Ricreo il pool e ricarico il modello.")
+        self.model_ready = False
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._start_pool()
+
+    async def _warm_up_workers(self):
+        loop = asyncio.get_running_loop()
+        # Submit one task per worker so all processes are spawned and warm before traffic
+        try:
+            results = await asyncio.gather(*[loop.run_in_executor(self.executor, _warm_up) for _ in range(WORKERS)])
+        except BrokenProcessPool:
+            results = [False] # A worker died while loading the model (e.g. out of memory)
+        self.model_ready = all(results)
+        if self.model_ready:
+            print(f"Modello '{MODEL_FILENAME}' caricato in {WORKERS} worker.")
+        else:
+            print(f"ERRORE: File del modello '{MODEL_FILENAME}' non caricato.")
+            print("Assicurati di aver eseguito prima lo script 'train_model.py'.")
+
+    @property
+    def warming_up(self):
+        return self._warm_up_task is not None and not self._warm_up_task.done()
+
+    def stop(self):
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self):
+        self.in_flight -= 1
+
+    async def predict(self, data):
+        """Returns (status_code, body_dict)."""
+        if not self.model_ready:
+            if self.warming_up:
+                return 503, {"error": "Modello in caricamento, riprova tra poco."}
+            return 500, {"error": "Modello non caricato correttamente. Impossibile fare predizioni."}
+        if self.in_flight >= MAX_QUEUE_DEPTH:
+            return 429, {"error": "Server di predizione sovraccarico, riprova tra poco."}
+
+        # The slot is released when the worker really finishes, not when the
+        # client gives up: a timed-out job still occupies a worker until it ends
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        self.in_flight += 1
+        try:
+            future = executor.submit(_predict, data)
+        except BrokenProcessPool:
+            self.in_flight -= 1
+            self._restart_pool(executor)
+            return 503, {"error": "Modello in caricamento, riprova tra poco."}
+        except Exception as e:
+            self.in_flight -= 1
+            return 500, {"error": f"Errore interno del server durante la predizione: {str(e)}"}
+        # The callback runs in the executor's thread: hop back onto the loop
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        try:
+            predicted_class = await asyncio.wait_for(asyncio.wrap_future(future), timeout=REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            return 504, {"error": "Timeout durante la predizione."}
+        except BrokenProcessPool:
+            # The worker running this (or another) prediction died: all pending jobs fail
+            self._restart_pool(executor)
+            return 503, {"error": "Modello in caricamento, riprova tra poco."}
+        except ValueError as ve:
+            return 400, {"error": str(ve)}
+        except Exception as e:
+            print(f"Errore durante la predizione: {e}")
+            return 500, {"error": f"Errore interno del server durante la predizione: {str(e)}"}
+        return 200, {"predicted_usage_level": predicted_class}
+
+service = PredictionService()
+
+# --- 4. ASGI APPLICATION ---
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-methods', b'POST, OPTIONS'),
+    (b'access-control-allow-headers', b'Content-Type'),
+]
+
+async def _send_json(send, status, body, extra_headers=()):
+    payload = json.dumps(body).encode('utf-8')
+    headers = [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers + CORS_HEADERS + list(extra_headers)})
+    await send({'type': 'http.response.body', 'body': payload})
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get('more_body', False):
+            return body
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await service.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            service.stop()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    if scope['path'] == '/ready' and scope['method'] == 'GET':
+        if service.model_ready:
+            return await _send_json(send, 200, {"status": "ready", "model": MODEL_FILENAME})
+        return await _send_json(send, 503, {"status": "warming_up" if service.warming_up else "error"})
+    if scope['path'] != '/predict':
+        return await _send_json(send, 404, {"error": "Not found"})
+    if scope['method'] == 'OPTIONS':
+        await send({'type': 'http.response.start', 'status': 204, 'headers': CORS_HEADERS})
+        return await send({'type': 'http.response.body', 'body': b''})
+    if scope['method'] != 'POST':
+        return await _send_json(send, 405, {"error": "Method not allowed"})
+
+    body = await _read_body(receive)
+    if body is None:
+        return await _send_json(send, 413, {"error": "Richiesta troppo grande."})
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+    if not data or not isinstance(data, dict):
+        return await _send_json(send, 400, {"error": "Nessun dato JSON ricevuto."})
+
+    # Check if all expected features are present in the input (cheap, done on the loop)
+    missing = missing_features([data])
+    if missing:
+        return await _send_json(send, 400, {"error": f"Dati mancanti: {', '.join(missing)}"})
+
+    status, response = await service.predict({feature: data[feature] for feature in EXPECTED_FEATURES})
+    extra_headers = [(b'retry-after', b'1')] if status in (429, 503) else []
+    await _send_json(send, status, response, extra_headers)
+
+# --- 5. RUN THE SERVER ---
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=5001)
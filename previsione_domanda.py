@@ -0,0 +1,93 @@
+import numpy as np
+
+# --- PREVISIONE SPAZIALE DELLA DOMANDA ---
+# Le ricariche vengono contate su una griglia (NIL x cella lat/lng) giorno per giorno.
+# Tutto lavora su array NumPy a blocchi: le ricariche arrivano in chunk
+# (dal DB o dagli snapshot) e ogni chunk diventa un solo np.bincount,
+# senza cicli Python riga per riga. La previsione è un trend lineare per cella,
+# calcolato in un'unica operazione matriciale su tutte le celle.
+
+
+class GrigliaDomanda:
+
+    def __init__(self, id_colonnine, lat, lng, nil, passo_gradi, n_giorni):
+        id_colonnine = np.asarray(id_colonnine, dtype=np.int64)
+        lat = np.asarray(lat, dtype=float)
+        lng = np.asarray(lng, dtype=float)
+        nil = np.array([n if n else 'Sconosciuto' for n in nil], dtype=str)
+        self.n_giorni = n_giorni
+
+        # Chiave di cella: (NIL, riga, colonna) della griglia
+        nil_unici, codici_nil = np.unique(nil, return_inverse=True)
+        chiavi = np.stack([
+            codici_nil.reshape(-1),
+            np.floor(lat / passo_gradi).astype(np.int64),
+            np.floor(lng / passo_gradi).astype(np.int64)
+        ], axis=1)
+        chiavi_uniche, gruppo = np.unique(chiavi, axis=0, return_inverse=True)
+        gruppo = gruppo.reshape(-1)
+        self.n_celle = len(chiavi_uniche)
+
+        # Tabella diretta ID_Colonnina -> cella (gli ID sono interi piccoli e densi)
+        self._cella_di = np.full(int(id_colonnine.max()) + 1 if len(id_colonnine) else 1, -1, dtype=np.int64)
+        self._cella_di[id_colonnine] = gruppo
+
+        # Posizione della cella: baricentro delle sue colonnine
+        self.n_colonnine = np.bincount(gruppo, minlength=self.n_celle)
+        self.lat = np.bincount(gruppo, weights=lat, minlength=self.n_celle) / np.maximum(self.n_colonnine, 1)
+        self.lng = np.bincount(gruppo, weights=lng, minlength=self.n_celle) / np.maximum(self.n_colonnine, 1)
+        self.nil = nil_unici[chiavi_uniche[:, 0]]
+
+        self._conteggi = np.zeros(self.n_celle * n_giorni, dtype=np.int64)
+
+    def aggiungi(self, id_colonnine, giorni, conteggi=None):
+        """
+        Aggiunge un chunk di ricariche: ID della colonnina e giorno (0 = primo giorno dello storico).
+        Con 'conteggi' ogni riga vale quel numero di ricariche (righe già aggregate dal DB).
+        """
+        id_colonnine = np.asarray(id_colonnine, dtype=np.int64)
+        giorni = np.asarray(giorni, dtype=np.int64)
+        validi = (id_colonnine >= 0) & (id_colonnine < len(self._cella_di)) & (giorni >= 0) & (giorni < self.n_giorni)
+        celle = self._cella_di[id_colonnine[validi]]
+        giorni = giorni[validi]
+        note = celle >= 0 # Colonnine eliminate nel frattempo
+        pesi = None
+        if conteggi is not None:
+            pesi = np.asarray(conteggi, dtype=np.int64)[validi][note]
+        somme = np.bincount(celle[note] * self.n_giorni + giorni[note], weights=pesi, minlength=self._conteggi.size)
+        self._conteggi += somme.astype(np.int64, copy=False)
+
+    @property
+    def matrice(self):
+        """Ricariche per [cella, giorno]."""
+        return self._conteggi.reshape(self.n_celle, self.n_giorni)
+
+
+def prevedi(matrice, giorni_previsione):
+    """
+    Domanda totale prevista per ogni cella nei prossimi giorni_previsione giorni:
+    retta dei minimi quadrati sulla serie giornaliera, valutata sui giorni futuri.
+    """
+    n_giorni = matrice.shape[1]
+    y = matrice.astype(float)
+    t = np.arange(n_giorni, dtype=float)
+    t_centrato = t - t.mean()
+    media = y.mean(axis=1)
+    denominatore = t_centrato @ t_centrato
+    pendenza = (y - media[:, None]) @ t_centrato / denominatore if denominatore else np.zeros(len(y))
+
+    t_futuri = np.arange(n_giorni, n_giorni + giorni_previsione, dtype=float) - t.mean()
+    giornaliera = media[:, None] + pendenza[:, None] * t_futuri[None, :]
+    return np.clip(giornaliera, 0, None).sum(axis=1) # La domanda non può essere negativa
+
+
+def migliori_celle(griglia, previsione, top):
+    """Le 'top' celle con domanda prevista più alta, dalla maggiore."""
+    ordine = np.argsort(-previsione, kind='stable')[:top]
+    return [{
+        'lat': float(griglia.lat[i]),
+        'lng': float(griglia.lng[i]),
+        'nil': str(griglia.nil[i]),
+        'domanda': float(previsione[i]),
+        'colonnine_esistenti': int(griglia.n_colonnine[i])
+    } for i in ordine if previsione[i] > 0]
@@ -0,0 +1,73 @@
+import os
+import json
+import tempfile
+from datetime import datetime
+
+# --- REGISTRO LOCALE DEI MODELLI ---
+# Ogni addestramento produce una versione immutabile:
+#
+#   modelli/v0001/model.pkl       pipeline (preprocessor + classificatore)
+#   modelli/v0001/metadata.json   schema delle feature, data, metriche, statistiche dei dati
+#   modelli/LATEST                nome della versione in uso (es. 'v0002')
+#
+# La versione viene scritta in una cartella temporanea e rinominata, poi LATEST
+# viene sostituito con os.replace: chi legge vede sempre una versione completa.
+# Modulo senza dipendenze pesanti: lo importano anche i server di predizione.
+
+CARTELLA_DEFAULT = 'modelli'
+FILE_MODELLO = 'model.pkl'
+FILE_METADATA = 'metadata.json'
+FILE_ULTIMA = 'LATEST'
+
+
+def versione_corrente(cartella=CARTELLA_DEFAULT):
+    """Nome della versione in uso, o None se il registro è vuoto."""
+    try:
+        with open(os.path.join(cartella, FILE_ULTIMA)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def percorso_modello(cartella=CARTELLA_DEFAULT, versione=None):
+    versione = versione or versione_corrente(cartella)
+    if versione is None:
+        return None
+    return os.path.join(cartella, versione, FILE_MODELLO)
+
+
+def leggi_metadata(cartella=CARTELLA_DEFAULT, versione=None):
+    versione = versione or versione_corrente(cartella)
+    if versione is None:
+        return None
+    with open(os.path.join(cartella, versione, FILE_METADATA)) as f:
+        return json.load(f)
+
+
+def _prossima_versione(cartella):
+    numeri = [int(nome[1:]) for nome in os.listdir(cartella) if nome.startswith('v') and nome[1:].isdigit()]
+    return f"v{max(numeri, default=0) + 1:04d}"
+
+
+def salva_versione(modello, metadata, cartella=CARTELLA_DEFAULT):
+    """Salva modello e metadati come nuova versione e la rende quella in uso. Restituisce il nome."""
+    import joblib
+
+    os.makedirs(cartella, exist_ok=True)
+    versione = _prossima_versione(cartella)
+    metadata = {**metadata, 'versione': versione, 'creato_il': datetime.now().isoformat()}
+
+    temporanea = tempfile.mkdtemp(prefix='.tmp-', dir=cartella)
+    joblib.dump(modello, os.path.join(temporanea, FILE_MODELLO))
+    with open(os.path.join(temporanea, FILE_METADATA), 'w') as f:
+        json.dump(metadata, f, indent=2, default=str)
+    # mkdtemp crea la cartella con permessi 0700: i server di predizione possono
+    # girare con un altro utente e devono poterla leggere
+    os.chmod(temporanea, 0o755)
+    os.rename(temporanea, os.path.join(cartella, versione))
+
+    puntatore = os.path.join(cartella, FILE_ULTIMA)
+    with open(puntatore + '.tmp', 'w') as f:
+        f.write(versione)
+    os.replace(puntatore + '.tmp', puntatore)
+    return versione
@@ -0,0 +1,200 @@
+import os
+import sys
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from dotenv import load_dotenv
+import train_model
+from registro_modelli import leggi_metadata, percorso_modello, salva_versione
+
+# --- PIPELINE DI RIADDESTRAMENTO CON CONTROLLO DEL DRIFT ---
+# 1. Estrae i dati come train_model.py (DB, replica o snapshot)
+# 2. Confronta la distribuzione delle feature con quella salvata insieme al
+#    modello in uso (mix di NIL, energia, durata, ricariche, potenza) usando il
+#    Population Stability Index (PSI). Se nessuna feature è cambiata, si ferma.
+# 3. Se possibile continua l'addestramento del modello in uso (warm start della
+#    Random Forest: si aggiungono alberi), altrimenti riaddestra da zero i 3 modelli.
+# 4. Salva una nuova versione nel registro (vedi registro_modelli.py).
+#
+# Uso: python retrain_model.py [--forza]
+# I server la usano con MODEL_FILENAME=modelli (la cartella del registro).
+
+load_dotenv()
+REGISTRO_DIR = os.environ.get('MODEL_REGISTRY_DIR', 'modelli')
+# PSI > 0.2 è la soglia usata di solito per un cambiamento significativo
+SOGLIA_PSI = float(os.environ.get('RETRAIN_SOGLIA_PSI', 0.2))
+ALBERI_AGGIUNTIVI = int(os.environ.get('RETRAIN_ALBERI_AGGIUNTIVI', 50))
+# Colonnine mai viste dal modello in uso sotto le quali le metriche del warm start non sono affidabili
+MIN_RIGHE_TEST_WARM_START = int(os.environ.get('RETRAIN_MIN_RIGHE_TEST', 20))
+# Quota delle colonnine nuove tenuta fuori per il test del warm start (le altre entrano negli alberi nuovi)
+QUOTA_TEST_NUOVE = float(os.environ.get('RETRAIN_QUOTA_TEST_NUOVE', 0.3))
+# Oltre questa quota di righe da colonnine nuove gli alberi vecchi sono poco rappresentativi: si riparte da zero
+MAX_QUOTA_NUOVE_WARM_START = float(os.environ.get('RETRAIN_MAX_QUOTA_NUOVE', 0.5))
+SEME_DIVISIONE = 42 # Lo stesso di train_model.dividi_dati
+EPSILON = 1e-4 # Evita log(0) per le classi vuote
+
+# --- 1. Statistiche e drift ---
+
+def _proporzioni(valori, bordi):
+    conteggi = np.bincount(np.searchsorted(bordi, valori, side='right'), minlength=len(bordi) + 1)
+    return conteggi / max(len(valori), 1)
+
+def statistiche_features(X):
+    """Statistiche da salvare con il modello: decili delle numeriche e mix dei NIL."""
+    numeriche = {}
+    for colonna in train_model.numerical_features:
+        valori = X[colonna].to_numpy(dtype=float)
+        # Bordi interni dei decili (unici: con molti zeri più decili coincidono)
+        bordi = np.unique(np.quantile(valori, np.linspace(0, 1, 11)[1:-1]))
+        numeriche[colonna] = {
+            'media': float(valori.mean()),
+            'std': float(valori.std()),
+            'bordi': bordi.tolist(),
+            'proporzioni': _proporzioni(valori, bordi).tolist()
+        }
+    nil = X['NIL'].value_counts(normalize=True)
+    return {'righe': len(X), 'numeriche': numeriche, 'NIL': {k: float(v) for k, v in nil.items()}}
+
+def psi(attese, osservate):
+    attese = np.clip(np.asarray(attese, dtype=float), EPSILON, None)
+    osservate = np.clip(np.asarray(osservate, dtype=float), EPSILON, None)
+    return float(np.sum((osservate - attese) * np.log(osservate / attese)))
+
+def calcola_drift(riferimento, X):
+    """PSI di ogni feature rispetto alle statistiche di riferimento."""
+    risultato = {}
+    for colonna, stat in riferimento['numeriche'].items():
+        bordi = np.asarray(stat['bordi'])
+        osservate = _proporzioni(X[colonna].to_numpy(dtype=float), bordi)
+        risultato[colonna] = psi(stat['proporzioni'], osservate)
+
+    nil_nuovi = X['NIL'].value_counts(normalize=True)
+    categorie = sorted(set(riferimento['NIL']) | set(nil_nuovi.index))
+    risultato['NIL'] = psi([riferimento['NIL'].get(c, 0.0) for c in categorie],
+                           [float(nil_nuovi.get(c, 0.0)) for c in categorie])
+    return risultato
+
+# --- 2. Warm start ---
+
+def continua_addestramento(pipeline, X_train, y_train):
+    """
+    Aggiunge alberi alla Random Forest in uso allenandoli sui nuovi dati.
+    Il preprocessor NON viene rifatto (gli alberi esistenti dipendono dalle sue colonne):
+    per questo il warm start si fa solo se classi e NIL sono gli stessi.
+    Restituisce la pipeline aggiornata, o None se il warm start non è applicabile.
+    """
+    classificatore = pipeline.named_steps['classifier']
+    if not isinstance(classificatore, RandomForestClassifier):
+        return None
+    if set(y_train.unique()) != set(classificatore.classes_):
+        return None
+
+    preprocessor = pipeline.named_steps['preprocessor']
+    encoder = preprocessor.named_transformers_['cat']
+    if not set(X_train['NIL'].unique()) <= set(encoder.categories_[0]):
+        return None
+
+    classificatore.set_params(warm_start=True, n_estimators=classificatore.n_estimators + ALBERI_AGGIUNTIVI)
+    classificatore.fit(preprocessor.transform(X_train), y_train)
+    return pipeline
+
+def dividi_per_warm_start(X, y, id_colonnine, id_visti):
+    """
+    Divisione per il warm start. Il test contiene solo colonnine che nessuna versione
+    della catena ha mai usato per l'addestramento (id_visti), altrimenti gli alberi
+    esistenti le conoscono già e l'accuracy risulta gonfiata: se ne tiene fuori una quota
+    fissa (QUOTA_TEST_NUOVE, con seme), le altre colonnine nuove vanno nel train insieme
+    a quelle già viste, così la catena impara anche dalle stazioni appena aggiunte.
+    Restituisce (X_train, X_test, y_train, y_test, confrontabili), oppure None se le
+    righe delle colonnine nuove superano MAX_QUOTA_NUOVE_WARM_START (serve un riaddestramento da zero).
+    """
+    visti = id_colonnine.isin(set(id_visti))
+    if (~visti).mean() > MAX_QUOTA_NUOVE_WARM_START:
+        return None
+
+    nuove = np.array(sorted(set(id_colonnine[~visti].tolist())))
+    if len(nuove) >= 2:
+        casuale = np.random.default_rng(SEME_DIVISIONE)
+        n_test = max(1, int(round(len(nuove) * QUOTA_TEST_NUOVE)))
+        test = id_colonnine.isin(set(casuale.choice(nuove, n_test, replace=False).tolist()))
+        X_test, y_test = X[test], y[test]
+        if len(X_test) >= MIN_RIGHE_TEST_WARM_START and y_test.nunique() >= 2:
+            return X[~test], X_test, y[~test], y_test, True
+    # Troppe poche colonnine nuove: si addestra e valuta come sempre, ma le metriche
+    # vengono segnate come non confrontabili con quelle delle versioni precedenti
+    X_train, X_test, y_train, y_test = train_model.dividi_dati(X, y)
+    return X_train, X_test, y_train, y_test, False
+
+# --- 3. Esecuzione ---
+
+def main(forza=False):
+    df = train_model.carica_dati()
+    X, y = train_model.prepara_dati(df)
+    id_colonnine = df.loc[X.index, 'ID_Colonnina']
+    statistiche = statistiche_features(X)
+    metadata_corrente = leggi_metadata(REGISTRO_DIR)
+
+    drift = None
+    if metadata_corrente is not None:
+        drift = calcola_drift(metadata_corrente['statistiche_features'], X)
+        print(f"\nDrift rispetto a {metadata_corrente['versione']} (PSI, soglia {SOGLIA_PSI}):")
+        for feature, valore in drift.items():
+            print(f"  {feature}: {valore:.4f}{'  <-- drift' if valore > SOGLIA_PSI else ''}")
+        if not forza and max(drift.values()) <= SOGLIA_PSI:
+            print("\nNessun drift significativo: riaddestramento saltato.")
+            return None
+
+    modello, nome, warm_start, confrontabili = None, None, False, True
+    if metadata_corrente is not None:
+        # Le versioni salvate prima di 'id_addestramento' non dicono cosa hanno visto
+        id_visti = metadata_corrente.get('id_addestramento')
+        divisione = None
+        if id_visti is not None:
+            divisione = dividi_per_warm_start(X, y, id_colonnine, id_visti)
+            if divisione is None:
+                print(f"\nPiù del {MAX_QUOTA_NUOVE_WARM_START:.0%} delle righe viene da colonnine nuove: riaddestramento da zero.")
+        else:
+            divisione = (*train_model.dividi_dati(X, y), False)
+        if divisione is not None:
+            X_train, X_test, y_train, y_test, confrontabili = divisione
+            corrente = joblib.load(percorso_modello(REGISTRO_DIR))
+            modello = continua_addestramento(corrente, X_train, y_train)
+        if modello is not None:
+            nome, warm_start = metadata_corrente['modello'], True
+            # Alberi vecchi e nuovi hanno visto solo colonnine di questa catena
+            id_addestramento = sorted(set(id_visti or []) | set(id_colonnine[X_train.index].tolist()))
+            print(f"\n--- Warm start: {nome} (+{ALBERI_AGGIUNTIVI} alberi) ---")
+            if not confrontabili:
+                print("Attenzione: poche colonnine mai viste dal modello, metriche non confrontabili.")
+            accuracy, report = train_model.valuta(modello, X_test, y_test)
+
+    if modello is None:
+        # Da zero: divisione normale, le metriche sono affidabili
+        X_train, X_test, y_train, y_test = train_model.dividi_dati(X, y)
+        confrontabili = True
+        id_addestramento = sorted(id_colonnine[X_train.index].tolist())
+        modello, nome, accuracy, risultati = train_model.addestra_e_confronta(X_train, X_test, y_train, y_test)
+        report = risultati[nome]['report']
+        print(f"\nIl modello migliore è: {nome} con Accuracy: {accuracy:.4f}")
+
+    versione = salva_versione(modello, {
+        'modello': nome,
+        'warm_start': warm_start,
+        'genitore': metadata_corrente['versione'] if metadata_corrente else None,
+        'feature_schema': {
+            'features': train_model.FEATURES,
+            'numeriche': train_model.numerical_features,
+            'categoriche': train_model.categorical_features
+        },
+        # confrontabili=False: il test può contenere colonnine già viste dagli alberi esistenti
+        'metriche': {'accuracy': accuracy, 'report': report, 'confrontabili': confrontabili, 'righe_test': len(X_test)},
+        'righe_addestramento': len(X_train),
+        'id_addestramento': [int(i) for i in id_addestramento],
+        'drift_psi': drift,
+        'statistiche_features': statistiche
+    }, cartella=REGISTRO_DIR)
+    print(f"Nuova versione '{versione}' salvata in '{REGISTRO_DIR}' e attivata.")
+    return versione
+
+if __name__ == '__main__':
+    main(forza='--forza' in sys.argv)
@@ -0,0 +1,95 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# --- PROTEZIONE DEL LOGIN ---
+# 1. BackendPassword: hash e verifica delle password (PBKDF2/scrypt) in un pool
+#    di thread limitato, così un'ondata di login non occupa tutta la CPU del worker.
+#    hashlib rilascia il GIL durante il calcolo, quindi le altre rotte proseguono.
+# 2. LimitatoreTokenBucket: limite di tentativi per chiave (IP o email), in memoria.
+
+
+class BackendSovraccarico(RuntimeError):
+    """Troppe verifiche di password in coda: la richiesta va rifiutata subito."""
+
+
+class BackendPassword:
+
+    def __init__(self, metodo=None, workers=2, max_coda=32, timeout=10.0):
+        # metodo: stringa di werkzeug (es. 'scrypt' o 'pbkdf2:sha256:600000'); None = default di werkzeug
+        self.metodo = metodo
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash-password')
+        # Posti disponibili = verifiche in esecuzione + in coda
+        self._posti = threading.BoundedSemaphore(workers + max_coda)
+        self._prefisso_attuale = None
+
+    def _esegui(self, funzione, *args):
+        if not self._posti.acquire(blocking=False):
+            raise BackendSovraccarico("Troppe richieste di login in corso, riprova tra poco.")
+        try:
+            futuro = self._executor.submit(funzione, *args)
+        except Exception:
+            self._posti.release()
+            raise
+        futuro.add_done_callback(lambda _: self._posti.release())
+        return futuro.result(timeout=self.timeout)
+
+    def _genera(self, password):
+        if self.metodo:
+            return generate_password_hash(password, method=self.metodo)
+        return generate_password_hash(password)
+
+    def genera(self, password):
+        return self._esegui(self._genera, password)
+
+    def verifica(self, hash_salvato, password):
+        return self._esegui(check_password_hash, hash_salvato, password)
+
+    def da_aggiornare(self, hash_salvato):
+        """
+        True se l'hash è stato calcolato con parametri diversi da quelli attuali
+        (es. meno iterazioni PBKDF2, o pbkdf2 invece di scrypt).
+        Werkzeug salva i parametri prima del primo '$': 'pbkdf2:sha256:600000$salt$hash'.
+        """
+        if self._prefisso_attuale is None:
+            self._prefisso_attuale = self._genera('').split('$', 1)[0]
+        return hash_salvato.split('$', 1)[0] != self._prefisso_attuale
+
+
+class LimitatoreTokenBucket:
+    """
+    Ogni chiave ha un secchio di 'capacita' gettoni che si ricarica di
+    'ricarica_al_secondo'. Ogni tentativo consuma un gettone: a secchio vuoto
+    il tentativo è rifiutato fino alla ricarica.
+    """
+
+    def __init__(self, capacita, ricarica_al_secondo, max_chiavi=100000):
+        self.capacita = float(capacita)
+        self.ricarica = float(ricarica_al_secondo)
+        self.max_chiavi = max_chiavi
+        self._secchi = {}   # chiave -> (gettoni, ultimo aggiornamento)
+        self._lock = threading.Lock()
+
+    def consenti(self, chiave):
+        """Restituisce (consentito, secondi da attendere prima del prossimo tentativo)."""
+        adesso = time.monotonic()
+        with self._lock:
+            gettoni, ultimo = self._secchi.get(chiave, (self.capacita, adesso))
+            gettoni = min(self.capacita, gettoni + (adesso - ultimo) * self.ricarica)
+            if gettoni >= 1:
+                self._secchi[chiave] = (gettoni - 1, adesso)
+                consentito, attesa = True, 0.0
+            else:
+                self._secchi[chiave] = (gettoni, adesso)
+                consentito, attesa = False, (1 - gettoni) / self.ricarica
+            if len(self._secchi) > self.max_chiavi:
+                self._pulisci(adesso)
+        return consentito, attesa
+
+    def _pulisci(self, adesso):
+        # I secchi ormai pieni equivalgono a chiavi mai viste: si possono dimenticare
+        pieni = [k for k, (g, t) in self._secchi.items() if g + (adesso - t) * self.ricarica >= self.capacita]
+        for chiave in pieni:
+            del self._secchi[chiave]
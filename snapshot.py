@@ -0,0 +1,193 @@
+import os
+import json
+import sys
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+# --- SNAPSHOT COLONNARI DI RICARICA E COLONNINA ---
+# Esporta le tabelle in Parquet su disco, così addestramento e statistiche
+# leggono da file e non caricano il database operativo.
+#
+#   <cartella>/colonnina/colonnina.parquet              (riscritta a ogni export)
+#   <cartella>/ricarica/data=YYYY-MM-DD/part-0.parquet  (una partizione per giorno)
+#   <cartella>/_stato.json                              (ultimo giorno esportato)
+#
+# L'export è incrementale: riscrive solo i giorni dall'ultimo export in poi, più
+# qualche giorno di margine per le ricariche chiuse in ritardo (Data_Ora_Fine
+# valorizzata dopo). In lettura il filtro sulla data scarta intere partizioni
+# e le statistiche dei row group (predicate pushdown).
+#
+# Uso: python snapshot.py [cartella]   (default: SNAPSHOT_DIR o 'snapshot')
+
+GIORNI_MARGINE = int(os.environ.get('SNAPSHOT_GIORNI_MARGINE', 2))
+RIGHE_PER_CHUNK = 100000
+
+# Schema fisso: un giorno con soli valori nulli non deve cambiare i tipi delle colonne
+SCHEMA_RICARICA = pa.schema([
+    ('ID_Ricarica', pa.int64()),
+    ('Data_Ora_Inizio', pa.timestamp('us')),
+    ('Data_Ora_Fine', pa.timestamp('us')),
+    ('Energia_Erogata_kWh', pa.float64()),
+    ('ID_Utente', pa.int64()),
+    ('ID_Colonnina', pa.int64()),
+    ('Targa_Auto', pa.string()),
+])
+SCHEMA_PARTIZIONI = ds.partitioning(pa.schema([('data', pa.string())]), flavor='hive')
+
+QUERY_RICARICHE = """
+SELECT ID_Ricarica, Data_Ora_Inizio, Data_Ora_Fine, Energia_Erogata_kWh,
+       ID_Utente, ID_Colonnina, Targa_Auto
+FROM ricarica
+WHERE Data_Ora_Inizio >= :da
+ORDER BY Data_Ora_Inizio
+"""
+
+QUERY_COLONNINE = """
+SELECT ID_Colonnina, Indirizzo, Latitudine, Longitudine, Potenza_kW, NIL, Stato
+FROM colonnina
+"""
+
+
+# --- 1. EXPORT ---
+
+def _scrivi_atomico(tabella, percorso):
+    # Scriviamo su un file temporaneo e lo sostituiamo: chi legge non vede mai file a metà
+    os.makedirs(os.path.dirname(percorso), exist_ok=True)
+    temporaneo = percorso + '.tmp'
+    pq.write_table(tabella, temporaneo)
+    os.replace(temporaneo, percorso)
+
+
+def _scrivi_giorno(cartella, giorno, df):
+    percorso = os.path.join(cartella, 'ricarica', f'data={giorno}', 'part-0.parquet')
+    tabella = pa.Table.from_pandas(df.drop(columns=['data']), schema=SCHEMA_RICARICA, preserve_index=False)
+    _scrivi_atomico(tabella, percorso)
+
+
+def _leggi_stato(cartella):
+    try:
+        with open(os.path.join(cartella, '_stato.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _scrivi_stato(cartella, stato):
+    percorso = os.path.join(cartella, '_stato.json')
+    with open(percorso + '.tmp', 'w') as f:
+        json.dump(stato, f, indent=2)
+    os.replace(percorso + '.tmp', percorso)
+
+
+def esporta(engine, cartella):
+    """Esporta colonnina (completa) e ricarica (incrementale per giorno). Restituisce le righe di ricarica scritte."""
+    stato = _leggi_stato(cartella)
+    oggi = datetime.now().date()
+
+    colonnine = pd.read_sql(text(QUERY_COLONNINE), engine)
+    _scrivi_atomico(pa.Table.from_pandas(colonnine, preserve_index=False),
+                    os.path.join(cartella, 'colonnina', 'colonnina.parquet'))
+    print(f"Colonnine esportate: {len(colonnine)}.")
+
+    if stato.get('ultimo_giorno'):
+        da = datetime.fromisoformat(stato['ultimo_giorno']) - timedelta(days=GIORNI_MARGINE)
+    else:
+        da = datetime(1970, 1, 1)
+
+    # Le ricariche arrivano ordinate per data: un giorno è completo quando il
+    # chunk successivo inizia con un giorno diverso, quindi teniamo da parte solo l'ultimo
+    righe = 0
+    in_sospeso = None
+    # stream_results: cursore lato server, i chunk non vengono caricati tutti in memoria
+    with engine.connect().execution_options(stream_results=True) as connessione:
+        for chunk in pd.read_sql(text(QUERY_RICARICHE), connessione, params={'da': da}, chunksize=RIGHE_PER_CHUNK,
+                                 parse_dates=['Data_Ora_Inizio', 'Data_Ora_Fine']):
+            chunk['data'] = chunk['Data_Ora_Inizio'].dt.strftime('%Y-%m-%d')
+            if in_sospeso is not None:
+                chunk = pd.concat([in_sospeso, chunk], ignore_index=True)
+            ultimo_giorno = chunk['data'].iloc[-1]
+            in_sospeso = chunk[chunk['data'] == ultimo_giorno]
+            for giorno, gruppo in chunk[chunk['data'] != ultimo_giorno].groupby('data', sort=False):
+                _scrivi_giorno(cartella, giorno, gruppo)
+                righe += len(gruppo)
+    if in_sospeso is not None and not in_sospeso.empty:
+        _scrivi_giorno(cartella, in_sospeso['data'].iloc[0], in_sospeso)
+        righe += len(in_sospeso)
+
+    _scrivi_stato(cartella, {'ultimo_giorno': oggi.isoformat(), 'esportato_il': datetime.now().isoformat()})
+    print(f"Ricariche esportate dal {da.date().isoformat()}: {righe}.")
+    return righe
+
+
+# --- 2. LETTURA ---
+
+def _dataset_ricariche(cartella):
+    return ds.dataset(os.path.join(cartella, 'ricarica'), format='parquet', partitioning=SCHEMA_PARTIZIONI,
+                      schema=SCHEMA_RICARICA.append(pa.field('data', pa.string())))
+
+
+def _filtro_ricariche(da=None, a=None, id_colonnine=None):
+    condizioni = []
+    if da is not None:
+        condizioni += [ds.field('data') >= da.strftime('%Y-%m-%d'), ds.field('Data_Ora_Inizio') >= pa.scalar(da)]
+    if a is not None:
+        condizioni += [ds.field('data') <= a.strftime('%Y-%m-%d'), ds.field('Data_Ora_Inizio') < pa.scalar(a)]
+    if id_colonnine is not None:
+        condizioni.append(ds.field('ID_Colonnina').isin(list(id_colonnine)))
+    filtro = None
+    for condizione in condizioni:
+        filtro = condizione if filtro is None else filtro & condizione
+    return filtro
+
+
+def leggi_ricariche(cartella, da=None, a=None, colonne=None, id_colonnine=None):
+    """
+    Ricariche con Data_Ora_Inizio in [da, a), come DataFrame pandas.
+    Il filtro su 'data' elimina le partizioni fuori finestra senza aprirle.
+    """
+    filtro = _filtro_ricariche(da, a, id_colonnine)
+    return _dataset_ricariche(cartella).to_table(columns=colonne, filter=filtro).to_pandas()
+
+
+def blocchi_ricariche(cartella, da=None, a=None, colonne=None, righe_per_blocco=RIGHE_PER_CHUNK):
+    """Come leggi_ricariche, ma un RecordBatch Arrow alla volta: la memoria resta costante."""
+    filtro = _filtro_ricariche(da, a)
+    yield from _dataset_ricariche(cartella).to_batches(columns=colonne, filter=filtro, batch_size=righe_per_blocco)
+
+
+def leggi_colonnine(cartella, colonne=None):
+    return pq.read_table(os.path.join(cartella, 'colonnina', 'colonnina.parquet'), columns=colonne).to_pandas()
+
+
+def ricariche_per_giorno(cartella, nil):
+    """Numero di ricariche per giorno nelle colonnine di un NIL (statistiche admin)."""
+    colonnine = leggi_colonnine(cartella, colonne=['ID_Colonnina', 'NIL'])
+    id_colonnine = colonnine.loc[colonnine['NIL'] == nil, 'ID_Colonnina'].tolist()
+    if not id_colonnine:
+        return [], []
+    # Basta la colonna di partizione: nessun dato delle ricariche viene materializzato
+    giorni = leggi_ricariche(cartella, colonne=['data'], id_colonnine=id_colonnine)['data']
+    conteggi = giorni.value_counts().sort_index()
+    return conteggi.index.tolist(), [int(n) for n in conteggi.values]
+
+
+# --- 3. ESECUZIONE DA RIGA DI COMANDO ---
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+    from db_pool import opzioni_engine
+
+    load_dotenv()
+    cartella = sys.argv[1] if len(sys.argv) > 1 else os.environ.get('SNAPSHOT_DIR', 'snapshot')
+    # L'export è solo lettura: usa la replica se configurata
+    url = os.environ.get('DATABASE_REPLICA_URL') or os.environ.get('DATABASE_URL')
+    if not url:
+        print("Errore: DATABASE_URL non trovato nel file .env")
+        sys.exit(1)
+
+    engine = create_engine(url, **opzioni_engine('snapshot'))
+    esporta(engine, cartella)
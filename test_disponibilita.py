@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+import pytest
+from conftest import accedi, crea_utente
+
+# --- TEST DELLA RICERCA DELLE FASCE LIBERE ---
+# Rotte vere (/api/disponibilita e /api/prenota) su SQLite: una fascia proposta
+# dalla ricerca deve essere accettata da prenota_colonnina.
+
+
+@pytest.fixture
+def client(app_test):
+    id_account = crea_utente(app_test, 'mario@example.com', targa='AB123CD')
+    with app_test.app.app_context():
+        for id_colonnina, stato in ((1, 'disponibile'), (2, 'occupata'), (3, 'manutenzione')):
+            app_test.db.session.add(app_test.COLONNINA(
+                ID_Colonnina=id_colonnina, Indirizzo=f'Via {id_colonnina}', Latitudine=45.46, Longitudine=9.19,
+                Potenza_kW=22, NIL='Brera', Stato=stato))
+        app_test.db.session.commit()
+    client = app_test.app.test_client()
+    accedi(client, id_account)
+    return client
+
+
+def cerca(client, **parametri):
+    adesso = datetime.now().replace(second=0, microsecond=0)
+    parametri.setdefault('inizio', (adesso + timedelta(minutes=1)).isoformat())
+    parametri.setdefault('fine', (adesso + timedelta(hours=3)).isoformat())
+    return client.get('/api/disponibilita', query_string=parametri)
+
+
+def test_colonnina_occupata_non_offre_fasce_immediate(client):
+    risposta = cerca(client)
+    assert risposta.status_code == 200
+    colonnine = {c['id']: c for c in risposta.get_json()['colonnine']}
+    assert set(colonnine) == {1, 2} # In manutenzione esclusa
+    assert colonnine[1]['libera_intera_finestra']
+    assert not colonnine[2]['libera_intera_finestra']
+
+    # La prima fascia della colonnina occupata si può prenotare davvero
+    fascia = colonnine[2]['fasce_libere'][0]
+    assert datetime.fromisoformat(fascia['inizio']) > datetime.now() + timedelta(minutes=15)
+    risposta = client.post('/api/prenota', json={'id_colonnina': 2, 'inizio': fascia['inizio'], 'fine': fascia['fine']})
+    assert risposta.status_code == 200, risposta.get_json()
+
+
+def test_colonnina_libera_prenotabile_da_subito(client):
+    fascia = {c['id']: c for c in cerca(client).get_json()['colonnine']}[1]['fasce_libere'][0]
+    risposta = client.post('/api/prenota', json={'id_colonnina': 1, 'inizio': fascia['inizio'], 'fine': fascia['fine']})
+    assert risposta.status_code == 200, risposta.get_json()
+
+
+@pytest.mark.parametrize('parametri', [
+    {'limite': '0'}, {'limite': '-3'}, {'limite': 'tanti'},
+    {'durata_minuti': 'abc'}, {'durata_minuti': '0'}, {'durata_minuti': str(8 * 24 * 60)},
+])
+def test_parametri_non_validi(client, parametri):
+    risposta = cerca(client, **parametri)
+    assert risposta.status_code == 400
+    assert 'invalid literal' not in risposta.get_json()['message']
+
+
+def test_limite_rispettato(client):
+    assert len(cerca(client, limite='1').get_json()['colonnine']) == 1
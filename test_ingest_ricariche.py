@@ -0,0 +1,157 @@
+import gzip
+import io
+import json
+from datetime import datetime
+import pytest
+from sqlalchemy import event, insert
+from ingest_ricariche import BufferRicariche, BufferPieno, RichiestaTroppoGrande, leggi_evento, leggi_ndjson
+
+# --- TEST DELL'INGEST DELLA TELEMETRIA ---
+# Parsing NDJSON con i limiti per richiesta, unione idempotente delle sessioni
+# e backpressure del buffer. La scrittura sul DB è sostituita da una lista.
+
+
+def riga(id_sessione='S1', tipo='inizio', id_colonnina=1, istante='2025-10-23T10:00:00', **altri):
+    evento = {'id_sessione': id_sessione, 'tipo': tipo, 'id_colonnina': id_colonnina, 'istante': istante, **altri}
+    return json.dumps(evento).encode('utf-8') + b'\n'
+
+
+def eventi(n, colonnine=50):
+    return [leggi_evento(riga(f'S{i}', id_colonnina=1 + i % colonnine)) for i in range(n)]
+
+
+# --- 1. Parsing e limiti per richiesta ---
+
+def test_leggi_ndjson_segnala_le_righe_non_valide():
+    body = riga('S1') + b'\n' + b'{non json\n' + riga('S2', tipo='boh') + riga('S3', tipo='fine', energia_kwh=12.5)
+    validi, errori = leggi_ndjson(io.BytesIO(body), max_righe=10, max_byte=10000)
+    assert [e['chiave'] for e in validi] == ['1:S1', '1:S3']
+    assert [e['riga'] for e in errori] == [3, 4]
+
+
+def test_leggi_ndjson_limite_righe():
+    body = b''.join(riga(f'S{i}') for i in range(11))
+    with pytest.raises(RichiestaTroppoGrande):
+        leggi_ndjson(io.BytesIO(body), max_righe=10, max_byte=10 ** 6)
+
+
+def test_leggi_ndjson_limite_byte_dopo_gzip():
+    # Pochi KB compressi, 100 MB decompressi: la lettura si ferma al limite
+    bomba = gzip.compress(b'\n' * (100 * 1024 * 1024))
+    assert len(bomba) < 200 * 1024
+    with pytest.raises(RichiestaTroppoGrande):
+        leggi_ndjson(gzip.GzipFile(fileobj=io.BytesIO(bomba)), max_righe=10 ** 9, max_byte=1024 * 1024)
+
+
+def test_leggi_ndjson_riga_troppo_lunga():
+    body = b'{"id_sessione": "' + b'x' * 10000 + b'"}\n'
+    with pytest.raises(RichiestaTroppoGrande):
+        leggi_ndjson(io.BytesIO(body), max_righe=10, max_byte=10 ** 6)
+
+
+# --- 2. Unione idempotente ---
+
+def test_unione_idempotente_e_fuori_ordine():
+    scritte = []
+    buffer = BufferRicariche(scritte.extend)
+    fine = leggi_evento(riga('S1', tipo='fine', istante='2025-10-23T11:00:00', energia_kwh=18.4))
+    energia = leggi_evento(riga('S1', tipo='energia', istante='2025-10-23T10:30:00', energia_kwh=9.0))
+    inizio = leggi_evento(riga('S1', tipo='inizio', istante='2025-10-23T10:00:00', targa='AB123CD'))
+    buffer.aggiungi([fine, energia])
+    buffer.aggiungi([inizio, fine]) # Evento reinviato
+    assert buffer.svuota() == 1
+    sessione = scritte[0]
+    assert sessione['inizio'].hour == 10 and sessione['inizio'].minute == 0
+    assert sessione['fine'].hour == 11
+    assert sessione['energia_kwh'] == 18.4
+    assert sessione['targa'] == 'AB123CD'
+
+
+def test_scrittura_fallita_rimette_le_sessioni_nel_buffer():
+    tentativi = []
+
+    def scrivi(sessioni):
+        tentativi.append(len(sessioni))
+        if len(tentativi) == 1:
+            raise RuntimeError('DB non raggiungibile')
+
+    buffer = BufferRicariche(scrivi)
+    buffer.aggiungi(eventi(100))
+    with pytest.raises(RuntimeError):
+        buffer.svuota()
+    assert buffer.in_attesa() == 100
+    assert buffer.svuota() == 100
+    assert buffer.stato()['errori'] == 1
+
+
+# --- 3. Backpressure ---
+
+def test_buffer_rifiuta_tutta_la_richiesta_oltre_il_limite():
+    buffer = BufferRicariche(lambda sessioni: None, max_in_attesa=10)
+    with pytest.raises(BufferPieno):
+        buffer.aggiungi(eventi(50000))
+    assert buffer.in_attesa() == 0 # Niente accettato a metà
+
+    buffer.aggiungi(eventi(10))
+    assert buffer.in_attesa() == 10
+    with pytest.raises(BufferPieno):
+        buffer.aggiungi(eventi(11))
+    assert buffer.in_attesa() == 10
+
+
+def test_buffer_accetta_aggiornamenti_di_sessioni_gia_in_attesa():
+    # Gli eventi di sessioni già nel buffer non occupano posti nuovi
+    buffer = BufferRicariche(lambda sessioni: None, max_in_attesa=10)
+    buffer.aggiungi(eventi(10))
+    buffer.aggiungi([leggi_evento(riga('S3', tipo='fine', id_colonnina=4, istante='2025-10-23T11:00:00'))])
+    assert buffer.in_attesa() == 10
+
+
+# --- 3. Scrittura sul DB (scrivi_sessioni) ---
+# L'upsert ON DUPLICATE KEY è solo MySQL: su SQLite lo sostituisce un INSERT semplice,
+# che fallisce allo stesso modo su una riga non valida (ID_Colonnina NULL).
+
+def sessione(chiave, id_colonnina, fine=None):
+    return {'chiave': chiave, 'id_colonnina': id_colonnina, 'inizio': datetime(2025, 10, 23, 10), 'fine': fine,
+            'energia_kwh': None, 'id_utente': None, 'targa': None}
+
+
+@pytest.fixture
+def app_ingest(app_test, monkeypatch):
+    def upsert_sqlite(sessioni):
+        app_test.db.session.execute(insert(app_test.RICARICA), [{
+            'Chiave_Idempotenza': s['chiave'], 'ID_Colonnina': s['id_colonnina'], 'Data_Ora_Inizio': s['inizio'],
+            'Data_Ora_Fine': s['fine']} for s in sessioni])
+
+    monkeypatch.setattr(app_test, '_upsert_ricariche', upsert_sqlite)
+    with app_test.app.app_context():
+        for id_colonnina in (1, 2):
+            app_test.db.session.add(app_test.COLONNINA(
+                ID_Colonnina=id_colonnina, Indirizzo='Via', Latitudine=45.46, Longitudine=9.19,
+                Potenza_kW=22, NIL='Brera', Stato='disponibile'))
+        app_test.db.session.commit()
+    return app_test
+
+
+def test_scrivi_sessioni_scarta_le_non_valide_in_una_transazione(app_ingest):
+    for endpoint in ('ricariche', 'colonnine'):
+        app_ingest._cache_api[(endpoint, None)] = object()
+    commit = []
+    def conta_commit(connessione):
+        commit.append(connessione)
+    with app_ingest.app.app_context():
+        engine = app_ingest.db.engine
+    event.listen(engine, 'commit', conta_commit) # Solo i COMMIT veri, non i RELEASE SAVEPOINT
+    try:
+        app_ingest.scrivi_sessioni([sessione('1:A', 1), sessione('0:X', None), sessione('2:B', 2, datetime(2025, 10, 23, 11)),
+                                    sessione('0:Y', None)])
+    finally:
+        event.remove(engine, 'commit', conta_commit)
+
+    assert len(commit) == 1 # Metà valide e Stato delle colonnine nello stesso commit
+    with app_ingest.app.app_context():
+        chiavi = app_ingest.db.session.scalars(app_ingest.db.select(app_ingest.RICARICA.Chiave_Idempotenza)).all()
+        assert sorted(chiavi) == ['1:A', '2:B']
+        assert app_ingest.db.session.get(app_ingest.COLONNINA, 1).Stato == 'occupata'
+        assert app_ingest.db.session.get(app_ingest.COLONNINA, 2).Stato == 'disponibile'
+    assert not app_ingest._cache_api # Le risposte di /api/ricariche e /api/colonnine vanno rigenerate
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import os
+import signal
+import pytest
+import prediction_server_async
+
+# --- TESTS FOR THE ASYNC PREDICTION SERVER ---
+# A worker process killed mid-service (as by the OOM killer) must not leave the
+# pool broken: the next request gets 503, /ready drops to 503 while the pool is
+# recreated and warmed up, and then predictions work again.
+
+MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model.pkl')
+INPUT = {'Potenza_kW': 22.0, 'NIL': 'Brera', 'RicaricheMedieGiornaliere': 3.5,
+         'DurataMediaMinuti': 45.0, 'EnergiaMediaKWh': 18.0}
+
+
+async def _ready_status():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await prediction_server_async.app({'type': 'http', 'path': '/ready', 'method': 'GET'}, None, send)
+    return sent[0]['status'], json.loads(sent[1]['body'])
+
+
+@pytest.mark.skipif(not os.path.exists(MODEL), reason="model.pkl not available")
+def test_pool_recreated_after_worker_dies(monkeypatch):
+    monkeypatch.setattr(prediction_server_async, 'WORKERS', 1)
+    monkeypatch.setattr(prediction_server_async, 'MODEL_FILENAME', MODEL)
+    service = prediction_server_async.PredictionService()
+    monkeypatch.setattr(prediction_server_async, 'service', service)
+
+    async def scenario():
+        await service.start()
+        try:
+            await service._warm_up_task
+            assert service.model_ready
+            assert (await service.predict(INPUT))[0] == 200
+
+            for pid in list(service.executor._processes):
+                os.kill(pid, signal.SIGKILL)
+            await asyncio.sleep(0.5) # Let the executor notice the dead worker
+
+            status, _ = await service.predict(INPUT)
+            assert status == 503
+            assert not service.model_ready
+            assert (await _ready_status())[0] == 503
+
+            await service._warm_up_task
+            assert (await _ready_status())[0] == 200
+            assert (await service.predict(INPUT))[0] == 200
+            await asyncio.sleep(0.1) # Slots are released by a callback scheduled on the loop
+            assert service.in_flight == 0
+        finally:
+            service.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,161 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from previsione_domanda import GrigliaDomanda, prevedi, migliori_celle
+
+# --- TEST DELLA PREVISIONE SPAZIALE DELLA DOMANDA ---
+# Griglia, trend e classifica su dati sintetici, più un controllo di tempo
+# sull'aggregazione di decine di milioni di ricariche a blocchi.
+
+N_COLONNINE = 2000
+GIORNI = 56
+
+
+def crea_griglia(n_colonnine=N_COLONNINE, giorni=GIORNI, seme=0):
+    casuale = np.random.default_rng(seme)
+    return GrigliaDomanda(
+        np.arange(1, n_colonnine + 1),
+        45.40 + casuale.random(n_colonnine) * 0.1,
+        9.10 + casuale.random(n_colonnine) * 0.1,
+        [f'NIL {i % 80}' for i in range(n_colonnine)],
+        0.005, giorni
+    )
+
+
+def test_celle_per_nil_e_posizione():
+    # Due colonnine vicine nello stesso NIL finiscono nella stessa cella, una in un altro NIL no
+    griglia = GrigliaDomanda([1, 2, 3], [45.4601, 45.4602, 45.4601], [9.1901, 9.1902, 9.1901],
+                             ['Brera', 'Brera', None], 0.005, 7)
+    assert griglia.matrice.shape == (2, 7)
+    assert sorted(griglia.n_colonnine.tolist()) == [1, 2]
+    assert 'Sconosciuto' in griglia.nil.tolist()
+
+
+def test_conteggi_aggregati_come_righe_singole():
+    # Le righe (colonnina, giorno, conteggio) del DB danno la stessa matrice delle ricariche una per una
+    casuale = np.random.default_rng(1)
+    id_colonnine = casuale.integers(1, N_COLONNINE + 1, 200000)
+    giorni = casuale.integers(0, GIORNI, 200000)
+
+    singole = crea_griglia()
+    singole.aggiungi(id_colonnine, giorni)
+
+    chiavi, conteggi = np.unique(np.stack([id_colonnine, giorni], axis=1), axis=0, return_counts=True)
+    aggregate = crea_griglia()
+    aggregate.aggiungi(chiavi[:, 0], chiavi[:, 1], conteggi)
+
+    assert np.array_equal(singole.matrice, aggregate.matrice)
+    assert singole.matrice.sum() == 200000
+
+
+def test_scarta_colonnine_e_giorni_fuori_griglia():
+    griglia = crea_griglia(n_colonnine=10, giorni=7)
+    griglia.aggiungi([1, 99, 2, -1, 3], [0, 0, 7, 1, -1], [5, 5, 5, 5, 5])
+    assert griglia.matrice.sum() == 5
+
+
+def test_prevedi_trend_lineare():
+    giorni = np.arange(14, dtype=float)
+    matrice = np.stack([2 * giorni + 1, np.full(14, 3.0), 10 - giorni])
+    previsione = prevedi(matrice, 2)
+    assert previsione[0] == pytest.approx((2 * 14 + 1) + (2 * 15 + 1))
+    assert previsione[1] == pytest.approx(6.0)
+    assert previsione[2] == 0 # La domanda prevista non scende sotto zero
+
+
+def test_migliori_celle_in_ordine():
+    griglia = GrigliaDomanda([1, 2, 3], [45.40, 45.45, 45.50], [9.10, 9.15, 9.20], ['A', 'B', 'C'], 0.005, 7)
+    celle = migliori_celle(griglia, np.array([1.0, 5.0, 0.0]), top=10)
+    assert [c['domanda'] for c in celle] == [5.0, 1.0] # Le celle senza domanda non vengono salvate
+    assert celle[0]['nil'] == 'B'
+    assert celle[0]['colonnine_esistenti'] == 1
+
+
+def test_tempo_aggregazione_decine_di_milioni():
+    # 30 milioni di ricariche in blocchi da 1 milione, come arrivano dagli snapshot
+    griglia = crea_griglia()
+    casuale = np.random.default_rng(2)
+    blocchi = [(casuale.integers(1, N_COLONNINE + 1, 1_000_000), casuale.integers(0, GIORNI, 1_000_000))
+               for _ in range(3)]
+    inizio = time.perf_counter()
+    for _ in range(10):
+        for id_colonnine, giorni in blocchi:
+            griglia.aggiungi(id_colonnine, giorni)
+    previsione = prevedi(griglia.matrice, 7)
+    migliori_celle(griglia, previsione, 100)
+    durata = time.perf_counter() - inizio
+    print(f"\n30 milioni di ricariche aggregate e previste in {durata:.2f} s")
+    assert griglia.matrice.sum() == 30_000_000
+    assert durata < 30 # Obiettivo: decine di milioni in meno di un minuto, con margine
+
+
+# --- genera_predizioni su SQLite ---
+# Conteggi per (colonnina, giorno) dal DB e dagli snapshot, poi le predizioni salvate.
+
+GIORNI_STORICO = 14
+
+
+@pytest.fixture
+def app_ricariche(app_test):
+    oggi = datetime.combine(datetime.now().date(), datetime.min.time())
+    with app_test.app.app_context():
+        for id_colonnina, lat, lng, nil in ((1, 45.4721, 9.1871, 'Brera'), (2, 45.4722, 9.1872, 'Brera'),
+                                            (3, 45.4881, 9.1911, 'Isola')):
+            app_test.db.session.add(app_test.COLONNINA(
+                ID_Colonnina=id_colonnina, Indirizzo='Via', Latitudine=lat, Longitudine=lng,
+                Potenza_kW=22, NIL=nil, Stato='disponibile'))
+        # Brera in crescita, Isola stabile; più una ricarica di oggi e una troppo vecchia, escluse
+        for giorno in range(GIORNI_STORICO):
+            inizio_giorno = oggi - timedelta(days=GIORNI_STORICO - giorno)
+            for n in range(2 + giorno // 2):
+                app_test.db.session.add(app_test.RICARICA(
+                    ID_Colonnina=1 + n % 2, Data_Ora_Inizio=inizio_giorno + timedelta(hours=n, minutes=30)))
+            app_test.db.session.add(app_test.RICARICA(
+                ID_Colonnina=3, Data_Ora_Inizio=inizio_giorno + timedelta(hours=23, minutes=59)))
+        for istante in (oggi + timedelta(minutes=1), oggi - timedelta(days=GIORNI_STORICO, seconds=1)):
+            app_test.db.session.add(app_test.RICARICA(ID_Colonnina=3, Data_Ora_Inizio=istante))
+        app_test.db.session.commit()
+    return app_test
+
+
+def conteggi(blocchi):
+    totali = Counter()
+    for id_colonnine, giorni, numeri in blocchi:
+        numeri = np.ones(len(id_colonnine), dtype=np.int64) if numeri is None else numeri
+        for chiave, numero in zip(zip(id_colonnine.tolist(), giorni.tolist()), numeri.tolist()):
+            totali[chiave] += numero
+    return totali
+
+
+def test_conteggi_dal_db_come_dagli_snapshot(app_ricariche, tmp_path, monkeypatch):
+    from snapshot import esporta
+    fine = datetime.combine(datetime.now().date(), datetime.min.time())
+    inizio = fine - timedelta(days=GIORNI_STORICO)
+    with app_ricariche.app.app_context():
+        dal_db = conteggi(app_ricariche._blocchi_ricariche(inizio, fine))
+        esporta(app_ricariche.db.engine, str(tmp_path))
+    monkeypatch.setitem(app_ricariche.app.config, 'SNAPSHOT_DIR', str(tmp_path))
+    dagli_snapshot = conteggi(app_ricariche._blocchi_ricariche(inizio, fine))
+
+    assert dal_db == dagli_snapshot
+    assert dal_db[(3, 0)] == 1 and dal_db[(3, GIORNI_STORICO - 1)] == 1
+    assert set(giorno for _, giorno in dal_db) == set(range(GIORNI_STORICO))
+    assert sum(dal_db.values()) == sum(2 + g // 2 for g in range(GIORNI_STORICO)) + GIORNI_STORICO
+
+
+def test_genera_predizioni(app_ricariche):
+    with app_ricariche.app.app_context():
+        periodo, salvate = app_ricariche.genera_predizioni(giorni_storico=GIORNI_STORICO, giorni_previsione=7,
+                                                           passo_gradi=0.005, top=10)
+        oggi = datetime.now().date()
+        assert periodo == f"{oggi.isoformat()}/{(oggi + timedelta(days=6)).isoformat()}"
+        assert salvate == 2
+        # Rigenerare lo stesso periodo sostituisce le righe
+        assert app_ricariche.genera_predizioni(giorni_storico=GIORNI_STORICO, giorni_previsione=7,
+                                               passo_gradi=0.005, top=10) == (periodo, 2)
+        predizioni = app_ricariche.PREDIZIONE.query.order_by(app_ricariche.PREDIZIONE.ID_Predizione).all()
+        assert [p.NIL_Riferimento for p in predizioni] == ['Brera', 'Isola']
+        assert float(predizioni[0].Domanda_Prevista) > float(predizioni[1].Domanda_Prevista)
+        assert float(predizioni[1].Domanda_Prevista) == pytest.approx(7.0)
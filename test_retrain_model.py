@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from retrain_model import dividi_per_warm_start
+
+# --- TEST DELLA DIVISIONE PER IL WARM START ---
+# Le colonnine nuove in parte vanno nel test (mai viste dalla catena), in parte
+# negli alberi aggiunti: quelle del train entrano in id_addestramento e non
+# restano escluse per sempre.
+
+RIGHE_PER_COLONNINA = 10
+
+
+def dati(id_colonnine):
+    id_colonnine = pd.Series(np.repeat(id_colonnine, RIGHE_PER_COLONNINA))
+    X = pd.DataFrame({'Potenza_kW': np.arange(len(id_colonnine), dtype=float)})
+    y = pd.Series(np.where(np.arange(len(id_colonnine)) % 3 == 0, 'alto', 'basso'))
+    return X, y, id_colonnine
+
+
+def test_colonnine_nuove_divise_tra_train_e_test():
+    X, y, id_colonnine = dati(range(1, 41))
+    id_visti = list(range(1, 31))
+    X_train, X_test, y_train, y_test, confrontabili = dividi_per_warm_start(X, y, id_colonnine, id_visti)
+    assert confrontabili
+    id_train, id_test = set(id_colonnine[X_train.index]), set(id_colonnine[X_test.index])
+    assert id_test and id_test.isdisjoint(id_visti) # Il test ha solo colonnine mai viste
+    assert id_train.isdisjoint(id_test)
+    assert id_train - set(id_visti) # Alcune colonnine nuove entrano negli alberi aggiunti
+    assert len(X_train) + len(X_test) == len(X)
+
+
+def test_divisione_ripetibile():
+    X, y, id_colonnine = dati(range(1, 41))
+    prima = dividi_per_warm_start(X, y, id_colonnine, range(1, 31))[1]
+    seconda = dividi_per_warm_start(X, y, id_colonnine, range(1, 31))[1]
+    assert prima.index.equals(seconda.index)
+
+
+def test_catena_assorbe_le_colonnine_nuove():
+    # Come fa main(): id_addestramento = visti + colonnine del train, a ogni versione
+    X, y, id_colonnine = dati(range(1, 41))
+    id_visti = set(range(1, 31))
+    for _ in range(3):
+        X_train = dividi_per_warm_start(X, y, id_colonnine, id_visti)[0]
+        id_visti |= set(id_colonnine[X_train.index])
+    assert len(id_visti) > 35
+
+
+def test_troppe_colonnine_nuove_riaddestramento_da_zero():
+    X, y, id_colonnine = dati(range(1, 41))
+    assert dividi_per_warm_start(X, y, id_colonnine, range(1, 11)) is None
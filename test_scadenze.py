@@ -0,0 +1,40 @@
+import threading
+import pytest
+
+# --- TEST DELL'AVVIO DEL WORKER DELLE SCADENZE ---
+# Con SCADENZE_INTERVALLO_SECONDI > 0 il thread parte solo quando l'app serve
+# richieste: i comandi flask importano app.py ma non devono avviarlo.
+
+
+def thread_scadenze():
+    return [t for t in threading.enumerate() if t.name == 'scadenze-prenotazioni']
+
+
+@pytest.fixture
+def app_con_worker(app_test, monkeypatch):
+    monkeypatch.setitem(app_test.app.config, 'SCADENZE_INTERVALLO_SECONDI', 3600)
+    monkeypatch.setattr(app_test, '_worker_scadenze', None)
+    return app_test
+
+
+def test_comando_flask_non_avvia_il_worker(app_con_worker):
+    prima = len(thread_scadenze())
+    risultato = app_con_worker.app.test_cli_runner().invoke(args=['scadi-prenotazioni'])
+    assert 'Prenotazioni scadute: 0' in risultato.output
+    assert app_con_worker._worker_scadenze is None
+    assert len(thread_scadenze()) == prima
+
+
+def test_worker_avviato_una_volta_alla_prima_richiesta(app_con_worker):
+    client = app_con_worker.app.test_client()
+    client.get('/login')
+    worker = app_con_worker._worker_scadenze
+    assert worker is not None and worker.is_alive() and worker.daemon
+    client.get('/login')
+    assert app_con_worker._worker_scadenze is worker
+
+
+def test_worker_disattivato(app_test):
+    assert app_test.app.config['SCADENZE_INTERVALLO_SECONDI'] == 0
+    app_test.app.test_client().get('/login')
+    assert app_test._worker_scadenze is None
@@ -0,0 +1,193 @@
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as HashTimeoutError
+import pytest
+from werkzeug.security import generate_password_hash
+import sicurezza_login
+from sicurezza_login import BackendPassword, BackendSovraccarico, LimitatoreTokenBucket
+from conftest import crea_utente
+
+# --- TEST DELLA PROTEZIONE DEL LOGIN ---
+# Limitatore e backend delle password non usano il DB: si testano da soli.
+# L'ultimo test è un piccolo carico stile credential stuffing sulla rotta
+# /login vera (app.test_client() su SQLite, vedi conftest.py).
+
+METODO_TEST = 'pbkdf2:sha256:20000' # Abbastanza costoso da misurare, abbastanza veloce per i test
+
+
+class Orologio:
+    """Sostituisce time.monotonic: il tempo avanza solo quando lo diciamo noi."""
+
+    def __init__(self):
+        self.adesso = 1000.0
+
+    def __call__(self):
+        return self.adesso
+
+
+@pytest.fixture
+def orologio(monkeypatch):
+    finto = Orologio()
+    monkeypatch.setattr(sicurezza_login.time, 'monotonic', finto)
+    return finto
+
+
+# --- 1. LimitatoreTokenBucket ---
+
+def test_limitatore_consuma_la_capacita_poi_rifiuta(orologio):
+    limitatore = LimitatoreTokenBucket(3, 1.0)
+    assert [limitatore.consenti('1.2.3.4')[0] for _ in range(3)] == [True, True, True]
+    consentito, attesa = limitatore.consenti('1.2.3.4')
+    assert not consentito
+    assert attesa == pytest.approx(1.0)
+
+
+def test_limitatore_chiavi_indipendenti(orologio):
+    limitatore = LimitatoreTokenBucket(1, 1.0)
+    assert limitatore.consenti('a')[0]
+    assert not limitatore.consenti('a')[0]
+    assert limitatore.consenti('b')[0]
+
+
+def test_limitatore_si_ricarica_nel_tempo(orologio):
+    limitatore = LimitatoreTokenBucket(2, 0.5) # Un gettone ogni 2 secondi
+    limitatore.consenti('x')
+    limitatore.consenti('x')
+    orologio.adesso += 1.0
+    consentito, attesa = limitatore.consenti('x')
+    assert not consentito
+    assert attesa == pytest.approx(1.0) # Mezzo gettone già maturato: manca 1 secondo
+    orologio.adesso += 1.0
+    assert limitatore.consenti('x')[0]
+    # La ricarica non supera la capacità
+    orologio.adesso += 3600
+    assert [limitatore.consenti('x')[0] for _ in range(3)] == [True, True, False]
+
+
+def test_limitatore_retry_after_come_in_login(orologio):
+    # login() risponde con Retry-After = int(attesa) + 1: mai 0, mai prima della ricarica
+    limitatore = LimitatoreTokenBucket(5, 5 / 60.0)
+    for _ in range(5):
+        limitatore.consenti('mario@example.com')
+    consentito, attesa = limitatore.consenti('mario@example.com')
+    assert not consentito
+    retry_after = int(attesa) + 1
+    assert retry_after == 13
+    orologio.adesso += retry_after
+    assert limitatore.consenti('mario@example.com')[0]
+
+
+def test_limitatore_pulisce_solo_i_secchi_pieni(orologio):
+    limitatore = LimitatoreTokenBucket(2, 1.0, max_chiavi=3)
+    limitatore.consenti('vecchia')
+    orologio.adesso += 10 # 'vecchia' torna piena
+    limitatore.consenti('a')
+    limitatore.consenti('b')
+    limitatore.consenti('c') # Supera max_chiavi: parte la pulizia
+    assert 'vecchia' not in limitatore._secchi
+    assert {'a', 'b', 'c'} <= set(limitatore._secchi)
+
+
+# --- 2. BackendPassword ---
+
+def test_backend_genera_e_verifica():
+    backend = BackendPassword(metodo=METODO_TEST)
+    hash_salvato = backend.genera('segreta')
+    assert hash_salvato.startswith('pbkdf2:sha256:20000$')
+    assert backend.verifica(hash_salvato, 'segreta')
+    assert not backend.verifica(hash_salvato, 'sbagliata')
+
+
+def test_backend_rifiuta_quando_pieno():
+    backend = BackendPassword(workers=1, max_coda=1)
+    sblocca = threading.Event()
+    in_corso = [threading.Thread(target=backend._esegui, args=(sblocca.wait,)) for _ in range(2)]
+    for thread in in_corso:
+        thread.start()
+    time.sleep(0.05) # Un posto in esecuzione e uno in coda sono occupati
+    try:
+        with pytest.raises(BackendSovraccarico):
+            backend.verifica(generate_password_hash('x', method=METODO_TEST), 'x')
+    finally:
+        sblocca.set()
+        for thread in in_corso:
+            thread.join()
+    # Liberati i posti, il backend accetta di nuovo
+    assert backend.verifica(generate_password_hash('x', method=METODO_TEST), 'x')
+
+
+def test_backend_timeout():
+    backend = BackendPassword(workers=1, timeout=0.05)
+    sblocca = threading.Event()
+    try:
+        with pytest.raises(HashTimeoutError):
+            backend._esegui(sblocca.wait)
+    finally:
+        sblocca.set()
+
+
+@pytest.mark.parametrize('metodo_salvato, da_aggiornare', [
+    ('pbkdf2:sha256:20000', False),
+    ('pbkdf2:sha256:1000', True),   # Meno iterazioni di quelle attuali
+    ('scrypt', True),               # Algoritmo diverso
+])
+def test_backend_da_aggiornare(metodo_salvato, da_aggiornare):
+    backend = BackendPassword(metodo=METODO_TEST)
+    assert backend.da_aggiornare(generate_password_hash('x', method=metodo_salvato)) is da_aggiornare
+
+
+# --- 3. Carico stile credential stuffing sulla rotta /login ---
+
+def _percentile(valori, p):
+    valori = sorted(valori)
+    return valori[min(len(valori) - 1, int(len(valori) * p / 100))]
+
+
+def test_carico_credential_stuffing(app_test, monkeypatch):
+    # Pool piccolo per vedere la coda piena; limitatori come in produzione
+    monkeypatch.setattr(app_test, '_protezione_login', (
+        BackendPassword(metodo=METODO_TEST, workers=2, max_coda=4),
+        LimitatoreTokenBucket(20, 20 / 60.0),
+        LimitatoreTokenBucket(5, 5 / 60.0),
+    ))
+    for i in range(50):
+        crea_utente(app_test, f'utente{i}@example.com', f'password{i}')
+
+    def tentativo(ip, email, password):
+        client = app_test.app.test_client()
+        inizio = time.perf_counter()
+        risposta = client.post('/login', json={'email': email, 'password': password}, environ_base={'REMOTE_ADDR': ip})
+        return time.perf_counter() - inizio, risposta.status_code
+
+    # Riferimento: un login valido senza carico (IP diversi per non consumare i limiti)
+    riferimento = statistics.median(tentativo(f'10.0.0.{i}', 'utente0@example.com', 'password0')[0] for i in range(5))
+
+    # Attacco: 2000 tentativi da 200 IP sui primi 40 account con password sbagliate,
+    # 8 client in parallelo (quanti i thread di un worker)
+    casuale = random.Random(42)
+    attacco = [(f'203.0.113.{casuale.randrange(200)}', f'utente{casuale.randrange(40)}@example.com', 'password123')
+               for _ in range(2000)]
+    with ThreadPoolExecutor(max_workers=8) as client:
+        risultati = list(client.map(lambda a: tentativo(*a), attacco))
+
+    # Rifiutati dai limiti o dal pool pieno (non aspettano nessun hash) e arrivati alla verifica
+    latenze_rifiutati = [durata for durata, esito in risultati if esito in (429, 503)]
+    latenze_verifica = [durata for durata, esito in risultati if esito == 401] or [0.0]
+    esiti = {codice: sum(1 for _, e in risultati if e == codice) for codice in (200, 401, 429, 503)}
+    assert sum(esiti.values()) == len(attacco), esiti
+
+    assert esiti[200] == 0
+    assert esiti[429] + esiti[503] > 0 # I limiti sono intervenuti
+    # I rifiuti restano veloci: nessuna attesa di hash, margine ampio per la macchina dei test
+    limite = riferimento * 10 + 0.25
+    assert _percentile(latenze_rifiutati, 99) <= limite, (esiti, riferimento)
+    # Le verifiche aspettano al massimo la coda del pool, (workers + max_coda) / workers hash,
+    # più la contesa del GIL con i client del test (stesso processo): ben sotto il timeout di 10 s
+    assert _percentile(latenze_verifica, 99) <= 1.0, (esiti, riferimento)
+
+    # Un utente legittimo non attaccato (IP ed email mai visti) entra ancora, senza attese anomale
+    durata, esito = tentativo('198.51.100.7', 'utente45@example.com', 'password45')
+    assert esito == 200
+    assert durata <= limite
@@ -0,0 +1,127 @@
+import os
+from datetime import datetime, timedelta
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+import snapshot
+
+# --- TEST DEGLI SNAPSHOT PARQUET ---
+# Export su una cartella temporanea da un DB SQLite: i giorni spezzati tra più
+# chunk, il riexport dei giorni nel margine e la lettura con potatura delle
+# partizioni devono dare le stesse ricariche (e le stesse statistiche) del DB.
+
+RICARICHE_PER_GIORNO = 7 # Più di RIGHE_PER_CHUNK: ogni giorno finisce su due o tre chunk
+GIORNI = 10
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'operativo.db'}")
+    with engine.begin() as connessione:
+        connessione.execute(text(
+            "CREATE TABLE colonnina (ID_Colonnina INTEGER PRIMARY KEY, Indirizzo TEXT, Latitudine REAL,"
+            " Longitudine REAL, Potenza_kW REAL, NIL TEXT, Stato TEXT)"))
+        connessione.execute(text(
+            "CREATE TABLE ricarica (ID_Ricarica INTEGER PRIMARY KEY, Data_Ora_Inizio DATETIME, Data_Ora_Fine DATETIME,"
+            " Energia_Erogata_kWh REAL, ID_Utente INTEGER, ID_Colonnina INTEGER, Targa_Auto TEXT)"))
+        for id_colonnina, nil in ((1, 'Brera'), (2, 'Brera'), (3, 'Isola')):
+            connessione.execute(text(
+                "INSERT INTO colonnina VALUES (:id, 'Via', 45.46, 9.19, 22, :nil, 'disponibile')"),
+                {'id': id_colonnina, 'nil': nil})
+        primo_giorno = datetime.combine(datetime.now().date(), datetime.min.time()) - timedelta(days=GIORNI - 1)
+        id_ricarica = 0
+        for giorno in range(GIORNI):
+            for n in range(RICARICHE_PER_GIORNO):
+                id_ricarica += 1
+                inizio = primo_giorno + timedelta(days=giorno, hours=n * 3)
+                connessione.execute(text(
+                    "INSERT INTO ricarica VALUES (:id, :inizio, :fine, 10.0, 1, :colonnina, 'AB123CD')"),
+                    {'id': id_ricarica, 'inizio': inizio.strftime('%Y-%m-%d %H:%M:%S'),
+                     'fine': (inizio + timedelta(minutes=40)).strftime('%Y-%m-%d %H:%M:%S'),
+                     'colonnina': id_ricarica % 3 + 1})
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def cartella(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, 'RIGHE_PER_CHUNK', 5)
+    monkeypatch.setattr(snapshot, 'GIORNI_MARGINE', 2)
+    return str(tmp_path / 'snapshot')
+
+
+def ricariche_db(engine):
+    return pd.read_sql(text("SELECT * FROM ricarica ORDER BY ID_Ricarica"), engine,
+                       parse_dates=['Data_Ora_Inizio', 'Data_Ora_Fine'])
+
+
+def test_giorni_spezzati_tra_chunk(engine, cartella):
+    assert snapshot.esporta(engine, cartella) == GIORNI * RICARICHE_PER_GIORNO
+
+    letto = snapshot.leggi_ricariche(cartella).sort_values('ID_Ricarica', ignore_index=True)
+    atteso = ricariche_db(engine)
+    assert letto['ID_Ricarica'].is_unique
+    pd.testing.assert_frame_equal(letto[atteso.columns], atteso, check_dtype=False)
+    # Ogni ricarica sta nella partizione del suo giorno
+    assert (letto['data'] == letto['Data_Ora_Inizio'].dt.strftime('%Y-%m-%d')).all()
+    assert len(os.listdir(os.path.join(cartella, 'ricarica'))) == GIORNI
+
+
+def test_riexport_nel_margine(engine, cartella):
+    snapshot.esporta(engine, cartella)
+    ieri = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+    vecchio = (datetime.now() - timedelta(days=GIORNI - 1)).strftime('%Y-%m-%d')
+    with engine.begin() as connessione:
+        # Una ricarica di ieri chiusa in ritardo, una nuova di oggi e una vecchia modificata fuori margine
+        connessione.execute(text("UPDATE ricarica SET Energia_Erogata_kWh = 33.0 WHERE date(Data_Ora_Inizio) = :g"),
+                            {'g': ieri})
+        connessione.execute(text("UPDATE ricarica SET Energia_Erogata_kWh = 99.0 WHERE date(Data_Ora_Inizio) = :g"),
+                            {'g': vecchio})
+        connessione.execute(text(
+            "INSERT INTO ricarica VALUES (1000, :inizio, NULL, NULL, 1, 1, 'AB123CD')"),
+            {'inizio': datetime.now().replace(microsecond=0).strftime('%Y-%m-%d %H:%M:%S')})
+
+    # Rilegge solo oggi più i giorni di margine, riscrivendo le partizioni per intero
+    assert snapshot.esporta(engine, cartella) == (snapshot.GIORNI_MARGINE + 1) * RICARICHE_PER_GIORNO + 1
+
+    letto = snapshot.leggi_ricariche(cartella)
+    assert letto['ID_Ricarica'].is_unique
+    assert len(letto) == GIORNI * RICARICHE_PER_GIORNO + 1
+    assert (letto.loc[letto['data'] == ieri, 'Energia_Erogata_kWh'] == 33.0).all()
+    assert (letto.loc[letto['data'] == vecchio, 'Energia_Erogata_kWh'] == 10.0).all()
+    assert letto.loc[letto['ID_Ricarica'] == 1000, 'Data_Ora_Fine'].isna().all()
+
+
+def test_potatura_delle_partizioni(engine, cartella):
+    snapshot.esporta(engine, cartella)
+    oggi = datetime.combine(datetime.now().date(), datetime.min.time())
+    da, a = oggi - timedelta(days=3, hours=-6), oggi - timedelta(days=1)
+
+    # Una partizione fuori finestra illeggibile: se il filtro la aprisse, la lettura fallirebbe
+    fuori = os.path.join(cartella, 'ricarica', f"data={(oggi - timedelta(days=5)).strftime('%Y-%m-%d')}",
+                         'part-0.parquet')
+    with open(fuori, 'wb') as f:
+        f.write(b'non parquet')
+
+    letto = snapshot.leggi_ricariche(cartella, da=da, a=a)
+    atteso = ricariche_db(engine)
+    atteso = atteso[(atteso['Data_Ora_Inizio'] >= da) & (atteso['Data_Ora_Inizio'] < a)]
+    assert sorted(letto['ID_Ricarica']) == sorted(atteso['ID_Ricarica'])
+    assert sum(len(blocco) for blocco in snapshot.blocchi_ricariche(cartella, da=da, a=a)) == len(atteso)
+
+    with pytest.raises(Exception):
+        snapshot.leggi_ricariche(cartella)
+
+
+def test_ricariche_per_giorno_come_le_statistiche_sql(engine, cartella):
+    snapshot.esporta(engine, cartella)
+    with engine.connect() as connessione:
+        statistiche = connessione.execute(text(
+            "SELECT date(r.Data_Ora_Inizio) AS giorno, count(r.ID_Ricarica) FROM ricarica r"
+            " JOIN colonnina c ON r.ID_Colonnina = c.ID_Colonnina WHERE c.NIL = :nil"
+            " GROUP BY date(r.Data_Ora_Inizio) ORDER BY date(r.Data_Ora_Inizio)"), {'nil': 'Brera'}).all()
+
+    labels, data = snapshot.ricariche_per_giorno(cartella, 'Brera')
+    assert labels == [giorno for giorno, _ in statistiche]
+    assert data == [totale for _, totale in statistiche]
+    assert snapshot.ricariche_per_giorno(cartella, 'Quarto Oggiaro') == ([], [])
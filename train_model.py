@@ -12,67 +12,101 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, accuracy_score
 import joblib # Usiamo joblib invece di pickle, è più efficiente per numpy arrays
 from datetime import datetime, timedelta
+from db_pool import opzioni_engine
 
 # --- 1. Caricamento Configurazione e Connessione DB ---
 load_dotenv()
 DATABASE_URL = os.environ.get('DATABASE_URL')
+# L'estrazione dei dati è solo lettura: se c'è una replica la usiamo per non caricare il primary
+DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+# Con SNAPSHOT_DIR leggiamo dagli snapshot Parquet (vedi snapshot.py) e il DB non viene toccato
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
 
-if not DATABASE_URL:
-    print("Errore: DATABASE_URL non trovato nel file .env")
-    exit()
+# Feature del modello (devono corrispondere a inference.EXPECTED_FEATURES)
+FEATURES = ['Potenza_kW', 'NIL', 'RicaricheMedieGiornaliere', 'DurataMediaMinuti', 'EnergiaMediaKWh']
+numerical_features = ['Potenza_kW', 'RicaricheMedieGiornaliere', 'DurataMediaMinuti', 'EnergiaMediaKWh']
+categorical_features = ['NIL']
 
-try:
-    engine = create_engine(DATABASE_URL)
-    print("Connessione al database stabilita.")
-except Exception as e:
-    print(f"Errore di connessione al database: {e}")
-    exit()
+def crea_engine():
+    if not DATABASE_URL:
+        print("Errore: DATABASE_URL non trovato nel file .env")
+        exit()
 
-# --- 2. Estrazione Dati ---
-try:
-    # Query per estrarre dati colonnine e calcolare features dalle ricariche
-    # Consideriamo le ricariche degli ultimi 90 giorni per definire l'utilizzo
-    ninety_days_ago = (datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d %H:%M:%S')
-    
-    query = f"""
-    SELECT 
-        c.ID_Colonnina,
-        c.Potenza_kW,
-        c.NIL,
-        COUNT(r.ID_Ricarica) AS NumeroRicariche90gg,
-        AVG(TIMESTAMPDIFF(MINUTE, r.Data_Ora_Inizio, r.Data_Ora_Fine)) AS DurataMediaMinuti,
-        AVG(r.Energia_Erogata_kWh) AS EnergiaMediaKWh
-    FROM 
-        colonnina c
-    LEFT JOIN 
-        ricarica r ON c.ID_Colonnina = r.ID_Colonnina 
-                  AND r.Data_Ora_Inizio >= '{ninety_days_ago}' 
-                  AND r.Data_Ora_Fine IS NOT NULL -- Considera solo ricariche completate
-    GROUP BY
-        c.ID_Colonnina, c.Potenza_kW, c.NIL;
-    """
-    
-    df = pd.read_sql(query, engine)
-    print(f"Estratti dati per {len(df)} colonnine.")
-    
-    if df.empty:
-        print("Nessun dato trovato per l'addestramento. Controlla le tabelle colonnina e ricarica.")
+    try:
+        if DATABASE_REPLICA_URL:
+            engine = create_engine(DATABASE_REPLICA_URL, **opzioni_engine('replica'))
+        else:
+            engine = create_engine(DATABASE_URL, **opzioni_engine('primary'))
+        print("Connessione al database stabilita.")
+        return engine
+    except Exception as e:
+        print(f"Errore di connessione al database: {e}")
         exit()
-        
-except Exception as e:
-    print(f"Errore durante l'estrazione dati: {e}")
-    exit()
 
-# --- 3. Feature Engineering e Creazione Target ---
+def estrai_da_snapshot(cartella, da):
+    """Stesse colonne della query SQL qui sotto, calcolate con pandas sugli snapshot."""
+    from snapshot import leggi_colonnine, leggi_ricariche
+
+    colonnine = leggi_colonnine(cartella, colonne=['ID_Colonnina', 'Potenza_kW', 'NIL'])
+    # Il filtro sulla data legge solo le partizioni degli ultimi 90 giorni
+    ricariche = leggi_ricariche(cartella, da=da, colonne=['ID_Colonnina', 'Data_Ora_Inizio', 'Data_Ora_Fine', 'Energia_Erogata_kWh'])
+    ricariche = ricariche[ricariche['Data_Ora_Fine'].notna()].copy() # Solo ricariche completate
+    # Come TIMESTAMPDIFF(MINUTE, ...): minuti interi
+    ricariche['DurataMinuti'] = (ricariche['Data_Ora_Fine'] - ricariche['Data_Ora_Inizio']).dt.total_seconds() // 60
+
+    aggregati = ricariche.groupby('ID_Colonnina').agg(
+        NumeroRicariche90gg=('Data_Ora_Inizio', 'size'),
+        DurataMediaMinuti=('DurataMinuti', 'mean'),
+        EnergiaMediaKWh=('Energia_Erogata_kWh', 'mean')
+    ).reset_index()
 
-# Calcola ricariche medie giornaliere
-df['RicaricheMedieGiornaliere'] = df['NumeroRicariche90gg'] / 90.0
+    risultato = colonnine.merge(aggregati, on='ID_Colonnina', how='left') # Come il LEFT JOIN
+    risultato['NumeroRicariche90gg'] = risultato['NumeroRicariche90gg'].fillna(0).astype(int)
+    return risultato
 
-# Gestisci valori nulli (es. colonnine senza ricariche)
-# Sintassi aggiornata per evitare FutureWarning
-df['DurataMediaMinuti'] = df['DurataMediaMinuti'].fillna(0)
-df['EnergiaMediaKWh'] = df['EnergiaMediaKWh'].fillna(0)
-df['NIL'] = df['NIL'].fillna('Sconosciuto') # Gestiamo NIL mancanti
+# --- 2. Estrazione Dati ---
+def carica_dati():
+    try:
+        # Query per estrarre dati colonnine e calcolare features dalle ricariche
+        # Consideriamo le ricariche degli ultimi 90 giorni per definire l'utilizzo
+        ninety_days_ago_dt = datetime.now() - timedelta(days=90)
+        ninety_days_ago = ninety_days_ago_dt.strftime('%Y-%m-%d %H:%M:%S')
+        
+        query = f"""
+        SELECT 
+            c.ID_Colonnina,
+            c.Potenza_kW,
+            c.NIL,
+            COUNT(r.ID_Ricarica) AS NumeroRicariche90gg,
+            AVG(TIMESTAMPDIFF(MINUTE, r.Data_Ora_Inizio, r.Data_Ora_Fine)) AS DurataMediaMinuti,
+            AVG(r.Energia_Erogata_kWh) AS EnergiaMediaKWh
+        FROM 
+            colonnina c
+        LEFT JOIN 
+            ricarica r ON c.ID_Colonnina = r.ID_Colonnina 
+                      AND r.Data_Ora_Inizio >= '{ninety_days_ago}' 
+                      AND r.Data_Ora_Fine IS NOT NULL -- Considera solo ricariche completate
+        GROUP BY
+            c.ID_Colonnina, c.Potenza_kW, c.NIL;
+        """
+        
+        if SNAPSHOT_DIR:
+            df = estrai_da_snapshot(SNAPSHOT_DIR, ninety_days_ago_dt)
+            print(f"Dati letti dagli snapshot in '{SNAPSHOT_DIR}'.")
+        else:
+            df = pd.read_sql(query, crea_engine())
+        print(f"Estratti dati per {len(df)} colonnine.")
+        
+        if df.empty:
+            print("Nessun dato trovato per l'addestramento. Controlla le tabelle colonnina e ricarica.")
+            exit()
+        return df
+            
+    except Exception as e:
+        print(f"Errore durante l'estrazione dati: {e}")
+        exit()
+
+# --- 3. Feature Engineering e Creazione Target ---
 
 # Definiamo le regole per creare il target 'Utilizzo_Classificato'
 # !!! SOGLIE MODIFICATE ARTIFICIALMENTE PER TEST CON POCHI DATI !!!
@@ -84,95 +118,120 @@ def classifica_utilizzo(ricariche_medie):
     else: # Più di 0.1 (circa 9 ricariche in 90gg)
          return 'alto' # Probabilmente non raggiungeremo 'alto' con i dati attuali
 
-df['Utilizzo_Classificato'] = df['RicaricheMedieGiornaliere'].apply(classifica_utilizzo)
+def prepara_dati(df):
+    """Calcola le feature e il target. Restituisce (X, y)."""
+    # Calcola ricariche medie giornaliere
+    df['RicaricheMedieGiornaliere'] = df['NumeroRicariche90gg'] / 90.0
 
-# Separiamo features (X) e target (y)
-X = df[['Potenza_kW', 'NIL', 'RicaricheMedieGiornaliere', 'DurataMediaMinuti', 'EnergiaMediaKWh']]
-y = df['Utilizzo_Classificato']
+    # Gestisci valori nulli (es. colonnine senza ricariche)
+    # Sintassi aggiornata per evitare FutureWarning
+    df['DurataMediaMinuti'] = df['DurataMediaMinuti'].fillna(0)
+    df['EnergiaMediaKWh'] = df['EnergiaMediaKWh'].fillna(0)
+    df['NIL'] = df['NIL'].fillna('Sconosciuto') # Gestiamo NIL mancanti
 
-print("\nDistribuzione del target 'Utilizzo_Classificato':")
-print(y.value_counts())
+    df['Utilizzo_Classificato'] = df['RicaricheMedieGiornaliere'].apply(classifica_utilizzo)
 
-# Controllo se ci sono abbastanza classi per la classificazione
-if len(y.unique()) < 2:
-    print("\nErrore: Il target ha meno di 2 classi uniche. Impossibile addestrare un classificatore.")
-    print("Possibili cause: poche ricariche nel DB o soglie di classificazione troppo estreme.")
-    exit()
+    # Separiamo features (X) e target (y)
+    X = df[FEATURES]
+    y = df['Utilizzo_Classificato']
 
-# --- 4. Preprocessing ---
+    print("\nDistribuzione del target 'Utilizzo_Classificato':")
+    print(y.value_counts())
 
-# Identifica colonne numeriche e categoriche
-numerical_features = ['Potenza_kW', 'RicaricheMedieGiornaliere', 'DurataMediaMinuti', 'EnergiaMediaKWh']
-categorical_features = ['NIL']
+    # Controllo se ci sono abbastanza classi per la classificazione
+    if len(y.unique()) < 2:
+        print("\nErrore: Il target ha meno di 2 classi uniche. Impossibile addestrare un classificatore.")
+        print("Possibili cause: poche ricariche nel DB o soglie di classificazione troppo estreme.")
+        exit()
+    return X, y
 
-# Crea i transformers
-numeric_transformer = StandardScaler()
-categorical_transformer = OneHotEncoder(handle_unknown='ignore') # Ignora NIL non visti in training
+# --- 4. Preprocessing ---
+
+def crea_preprocessor():
+    # Crea i transformers
+    numeric_transformer = StandardScaler()
+    categorical_transformer = OneHotEncoder(handle_unknown='ignore') # Ignora NIL non visti in training
 
-# Crea il preprocessor con ColumnTransformer
-preprocessor = ColumnTransformer(
-    transformers=[
-        ('num', numeric_transformer, numerical_features),
-        ('cat', categorical_transformer, categorical_features)
-    ])
+    # Crea il preprocessor con ColumnTransformer
+    return ColumnTransformer(
+        transformers=[
+            ('num', numeric_transformer, numerical_features),
+            ('cat', categorical_transformer, categorical_features)
+        ])
 
 # --- 5. Definizione, Addestramento e Valutazione Modelli ---
 
-# Definiamo i 3 modelli da confrontare
-models = {
-    "Logistic Regression": LogisticRegression(max_iter=1000, multi_class='auto', solver='liblinear'), # solver='liblinear' buono per piccoli dataset
-    "Decision Tree": DecisionTreeClassifier(random_state=42),
-    "Random Forest": RandomForestClassifier(random_state=42, n_estimators=100)
-}
-
-results = {}
-
-# Dividiamo i dati in training e test set
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y) # stratify per mantenere proporzioni classi
-
-print(f"\nDati divisi: {len(X_train)} training, {len(X_test)} test.")
-
-best_model = None
-best_accuracy = 0.0
-best_model_name = ""
-
-for name, model in models.items():
-    print(f"\n--- Addestramento e Valutazione: {name} ---")
-    
-    # Crea la pipeline completa: preprocessing + modello
-    pipeline = Pipeline(steps=[('preprocessor', preprocessor),
-                               ('classifier', model)])
-    
-    # Addestramento
-    pipeline.fit(X_train, y_train)
-    
-    # Previsione sul test set
+def crea_modelli():
+    # Definiamo i 3 modelli da confrontare
+    return {
+        "Logistic Regression": LogisticRegression(max_iter=1000, multi_class='auto', solver='liblinear'), # solver='liblinear' buono per piccoli dataset
+        "Decision Tree": DecisionTreeClassifier(random_state=42),
+        "Random Forest": RandomForestClassifier(random_state=42, n_estimators=100)
+    }
+
+def dividi_dati(X, y):
+    # Dividiamo i dati in training e test set
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y) # stratify per mantenere proporzioni classi
+    print(f"\nDati divisi: {len(X_train)} training, {len(X_test)} test.")
+    return X_train, X_test, y_train, y_test
+
+def valuta(pipeline, X_test, y_test):
+    # Previsione sul test set e valutazione
     y_pred = pipeline.predict(X_test)
-    
-    # Valutazione
     accuracy = accuracy_score(y_test, y_pred)
     report = classification_report(y_test, y_pred, zero_division=0)
-    
-    results[name] = {"accuracy": accuracy, "report": report}
-    
     print(f"Accuracy: {accuracy:.4f}")
     print("Classification Report:")
     print(report)
-    
-    # Tieni traccia del modello migliore (basato sull'accuracy qui, ma potresti usare F1-score)
-    if accuracy > best_accuracy:
-        best_accuracy = accuracy
-        best_model = pipeline # Salviamo l'intera pipeline
-        best_model_name = name
+    return accuracy, report
 
-# --- 6. Selezione e Salvataggio del Modello Migliore ---
+def addestra_e_confronta(X_train, X_test, y_train, y_test):
+    """Addestra i 3 modelli e restituisce (pipeline migliore, nome, accuracy, risultati)."""
+    results = {}
+    best_model = None
+    best_accuracy = 0.0
+    best_model_name = ""
 
-print(f"\nIl modello migliore è: {best_model_name} con Accuracy: {best_accuracy:.4f}")
+    for name, model in crea_modelli().items():
+        print(f"\n--- Addestramento e Valutazione: {name} ---")
+        
+        # Crea la pipeline completa: preprocessing + modello
+        pipeline = Pipeline(steps=[('preprocessor', crea_preprocessor()),
+                                   ('classifier', model)])
+        
+        # Addestramento
+        pipeline.fit(X_train, y_train)
+        
+        # Valutazione
+        accuracy, report = valuta(pipeline, X_test, y_test)
+        results[name] = {"accuracy": accuracy, "report": report}
+        
+        # Tieni traccia del modello migliore (basato sull'accuracy qui, ma potresti usare F1-score)
+        if accuracy > best_accuracy:
+            best_accuracy = accuracy
+            best_model = pipeline # Salviamo l'intera pipeline
+            best_model_name = name
+
+    return best_model, best_model_name, best_accuracy, results
+
+# --- 6. Selezione e Salvataggio del Modello Migliore ---
 
-# Salviamo la pipeline completa (preprocessor + modello addestrato)
-model_filename = 'model.pkl' # Convenzione usare .pkl anche per joblib
-try:
-    joblib.dump(best_model, model_filename)
-    print(f"Modello migliore salvato come '{model_filename}'")
-except Exception as e:
-    print(f"Errore durante il salvataggio del modello: {e}")
\ No newline at end of file
+def main():
+    X, y = prepara_dati(carica_dati())
+    X_train, X_test, y_train, y_test = dividi_dati(X, y)
+    best_model, best_model_name, best_accuracy, results = addestra_e_confronta(X_train, X_test, y_train, y_test)
+
+    print(f"\nIl modello migliore è: {best_model_name} con Accuracy: {best_accuracy:.4f}")
+
+    # Salviamo la pipeline completa (preprocessor + modello addestrato)
+    model_filename = 'model.pkl' # Convenzione usare .pkl anche per joblib
+    try:
+        # File temporaneo + rename: i server in esecuzione non leggono mai un file a metà
+        joblib.dump(best_model, model_filename + '.tmp')
+        os.replace(model_filename + '.tmp', model_filename)
+        print(f"Modello migliore salvato come '{model_filename}'")
+    except Exception as e:
+        print(f"Errore durante il salvataggio del modello: {e}")
+
+if __name__ == '__main__':
+    main()